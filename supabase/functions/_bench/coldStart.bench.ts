@@ -0,0 +1,61 @@
+// 冷启动基准：对比新 isolate 加载 Lark SDK 与加载精简 fetch 客户端（_shared/larkClient.ts）的启动耗时
+// 每次迭代启动一个新的 deno 进程，只执行模块加载与客户端初始化，不发起任何网络请求
+//
+// 运行：
+//   deno bench --allow-run --allow-read --allow-env supabase/functions/_bench/coldStart.bench.ts
+
+// 子进程所需的环境变量（仅用于通过模块加载时的校验，不会真正连接）
+const env = {
+  SUPABASE_URL: 'http://127.0.0.1:54321',
+  SUPABASE_SERVICE_ROLE_KEY: 'bench',
+  'FEISHU_Lesstaking-ERP_APP_ID': 'bench',
+  'FEISHU_Lesstaking-ERP_APP_SECRET': 'bench',
+};
+
+const supabaseClientUrl = new URL('../_shared/supabaseClient.ts', import.meta.url).href;
+const larkClientUrl = new URL('../_shared/larkClient.ts', import.meta.url).href;
+
+// 改造前：各函数加载 supabaseClient 的同时加载完整 SDK 并在模块顶层构造 Lark.Client
+const sdkSource = `
+  await import(${JSON.stringify(supabaseClientUrl)});
+  const { default: Lark } = await import("npm:@larksuiteoapi/node-sdk");
+  new Lark.Client({ appId: "bench", appSecret: "bench", disableTokenCache: true, domain: "https://open.feishu.cn" });
+`;
+
+// 改造后：加载精简客户端（内部已包含 supabaseClient 与 token 管理）
+const slimSource = `
+  await import(${JSON.stringify(larkClientUrl)});
+`;
+
+async function bootIsolate(source: string): Promise<void> {
+  const { success, stderr } = await new Deno.Command(Deno.execPath(), {
+    args: ['eval', source],
+    env,
+    stdout: 'null',
+    stderr: 'piped',
+  }).output();
+  if (!success) {
+    throw new Error(new TextDecoder().decode(stderr));
+  }
+}
+
+Deno.bench({
+  name: 'cold start: Lark SDK',
+  group: 'cold-start',
+  baseline: true,
+  n: 20,
+  warmup: 2,
+  async fn() {
+    await bootIsolate(sdkSource);
+  },
+});
+
+Deno.bench({
+  name: 'cold start: fetch-based larkClient',
+  group: 'cold-start',
+  n: 20,
+  warmup: 2,
+  async fn() {
+    await bootIsolate(slimSource);
+  },
+});
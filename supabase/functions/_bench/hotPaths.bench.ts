@@ -0,0 +1,256 @@
+// 逐记录热点路径基准：字段值转换、行转换 / 编码、消息分组、事件解密与签名
+// 夹具覆盖 23 种飞书字段类型；除 Deno.bench 给出的 ops/sec 外，加载时还会打印每次调用的近似堆分配
+//
+// 运行：
+//   deno bench supabase/functions/_bench/hotPaths.bench.ts
+// 更稳定的分配统计（测量前先触发 GC）：
+//   deno bench --v8-flags=--expose-gc supabase/functions/_bench/hotPaths.bench.ts
+
+import { transformFieldValue, transformFieldValueByType, getFieldTransformer } from '../_shared/transBitableRecordsToDB.ts';
+import { compileBitableRowConverter, compileBitableFieldsEncoder, type FieldMappingRow } from '../_shared/mappingCompiler.ts';
+import { groupByAppTokenAndTableId, type BitableGroupItem } from '../_shared/bitableGroups.ts';
+import { decryptFeishu, computeFeishuSignature } from '../_shared/feishuCrypto.ts';
+import { createHash } from 'node:crypto';
+
+// —— 夹具 ——
+
+const FIELD_TYPES = [1, 2, 3, 4, 5, 7, 11, 13, 15, 17, 18, 19, 20, 21, 22, 23, 24, 1001, 1002, 1003, 1004, 1005, 3001];
+
+// batch_get 返回的飞书字段值（飞书 → 数据库方向）
+const FEISHU_VALUES: Record<number, any> = {
+  1: [{ type: 'text', text: '产品说明：' }, { type: 'mention', text: '@张三', mentionType: 'User' }, { type: 'text', text: ' 已确认' }],
+  2: 1234.5,
+  3: '选项A',
+  4: ['选项A', '选项B', '选项C'],
+  5: 1700000000000,
+  7: true,
+  11: [{ id: 'ou_0123456789abcdef', name: '张三', email: 'zhangsan@example.com' }],
+  13: '13800000000',
+  15: { link: 'https://example.com/p/1', text: '产品页' },
+  17: [{ file_token: 'boxcnabc', name: 'a.png', size: 1024, type: 'image/png', url: 'https://example.com/a.png', tmp_url: '' }],
+  18: { link_record_ids: ['recA1', 'recA2'] },
+  19: { type: 1, value: [{ type: 'text', text: '查找引用' }] },
+  20: { type: 2, value: [42] },
+  21: { link_record_ids: ['recB1'] },
+  22: { location: '116.397755,39.903179', pname: '北京市', cityname: '北京市', adname: '东城区', address: '天安门', name: '天安门', full_address: '北京市东城区天安门' },
+  23: [{ id: 'oc_0123456789abcdef', name: '项目群', avatar_url: '' }],
+  24: [{ stage_id: 'stg1', stage_name: '进行中', status: 'doing' }],
+  1001: 1700000000000,
+  1002: 1700000100000,
+  1003: [{ id: 'ou_0123456789abcdef', name: '张三' }],
+  1004: [{ id: 'ou_fedcba9876543210', name: '李四' }],
+  1005: '000123',
+  3001: { title: '审批' },
+};
+
+// 数据库中的行值（数据库 → 飞书方向）
+const DB_VALUES: Record<number, any> = {
+  1: '产品说明：已确认',
+  2: '1234.50',
+  3: '选项A',
+  4: ['选项A', '选项B', '选项C'],
+  5: '2023-11-14T22:13:20.000Z',
+  7: 't',
+  11: 'ou_0123456789abcdef',
+  13: 13800000000,
+  15: 'https://example.com/p/1',
+  17: ['boxcnabc'],
+  18: { link_record_ids: ['recA1', 'recA2'] },
+  19: '查找引用',
+  20: 42,
+  21: 'recB1',
+  22: { longitude: 116.397755, latitude: 39.903179 },
+  23: ['oc_0123456789abcdef'],
+  24: 'stg1',
+  1001: '2023-11-14T22:13:20.000Z',
+  1002: '2023-11-14T22:15:00.000Z',
+  1003: 'ou_0123456789abcdef',
+  1004: 'ou_fedcba9876543210',
+  1005: '000123',
+  3001: null,
+};
+
+const MAPPINGS: FieldMappingRow[] = FIELD_TYPES.map(type => ({
+  db_field: `f_${type}`,
+  feishu_field_name: `字段_${type}`,
+  feishu_field_type: type,
+}));
+
+const FEISHU_RECORDS = Array.from({ length: 100 }, (_, i) => ({
+  record_id: `rec${i}`,
+  fields: Object.fromEntries(FIELD_TYPES.map(type => [`字段_${type}`, FEISHU_VALUES[type]])),
+}));
+
+const DB_ROWS = Array.from({ length: 100 }, (_, i) => ({
+  id: i,
+  record_id: `rec${i}`,
+  ...Object.fromEntries(FIELD_TYPES.map(type => [`f_${type}`, DB_VALUES[type]])),
+}));
+
+// 50 张表 × 20 条消息，每条消息 5 条记录，记录在消息间部分重复
+const GROUP_ITEMS: BitableGroupItem[] = Array.from({ length: 1000 }, (_, i) => ({
+  app_token: `bascn${i % 5}`,
+  table_id: `tbl${i % 50}`,
+  records: Array.from({ length: 5 }, (_, j) => ({ record_id: `rec${(i * 3 + j) % 400}`, update_time: 1700000000 + i })),
+  msg_queue_info: [{ msg_id: i, queue_name: 'invoke_edge_function_jobs' }],
+}));
+
+// 加密事件：与飞书相同的 AES-256-CBC（key = sha256(encryptKey)，前 16 字节为 IV）
+const ENCRYPT_KEY = 'bench-encrypt-key';
+const EVENT_BODY = JSON.stringify({
+  schema: '2.0',
+  header: { event_id: 'evt_bench', event_type: 'drive.file.bitable_record_changed_v1', create_time: '1700000000000' },
+  event: {
+    file_token: 'bascn0',
+    table_id: 'tbl0',
+    action_list: Array.from({ length: 10 }, (_, i) => ({ action: 'record_edited', record_id: `rec${i}` })),
+    update_time: 1700000000,
+  },
+});
+
+async function encryptFixture(plain: string, encryptKey: string): Promise<string> {
+  const keyBytes = await crypto.subtle.digest('SHA-256', new TextEncoder().encode(encryptKey));
+  const key = await crypto.subtle.importKey('raw', keyBytes, { name: 'AES-CBC' }, false, ['encrypt']);
+  const iv = crypto.getRandomValues(new Uint8Array(16));
+  const cipher = new Uint8Array(await crypto.subtle.encrypt({ name: 'AES-CBC', iv }, key, new TextEncoder().encode(plain)));
+  const raw = new Uint8Array(16 + cipher.length);
+  raw.set(iv, 0);
+  raw.set(cipher, 16);
+  return btoa(Array.from(raw, b => String.fromCharCode(b)).join(''));
+}
+
+const ENCRYPTED = await encryptFixture(EVENT_BODY, ENCRYPT_KEY);
+const RAW_BODY = new TextEncoder().encode(JSON.stringify({ encrypt: ENCRYPTED }));
+
+const rowConverter = compileBitableRowConverter(MAPPINGS);
+const fieldsEncoder = compileBitableFieldsEncoder(MAPPINGS);
+const typedTransformers = FIELD_TYPES.map(type => [getFieldTransformer(type), FEISHU_VALUES[type]] as const);
+
+// —— 近似分配统计 ——
+
+// 堆用量差值 / 次数；期间若发生 GC 结果会偏小，仅用于发现量级上的回归
+function bytesPerOp(fn: () => unknown, iterations = 2000): number {
+  const gc = (globalThis as any).gc as (() => void) | undefined;
+  for (let i = 0; i < 100; i++) fn();
+  gc?.();
+  const before = Deno.memoryUsage().heapUsed;
+  for (let i = 0; i < iterations; i++) fn();
+  return Math.max(0, Math.round((Deno.memoryUsage().heapUsed - before) / iterations));
+}
+
+const syncCases: Record<string, () => unknown> = {
+  'transformFieldValue × 23 类型': () => FIELD_TYPES.map(type => transformFieldValue(FEISHU_VALUES[type])),
+  'transformFieldValueByType × 23 类型': () => FIELD_TYPES.map(type => transformFieldValueByType(FEISHU_VALUES[type], type)),
+  'getFieldTransformer（已编译）× 23 类型': () => typedTransformers.map(([transform, value]) => transform(value)),
+  '行转换 100 条（编译）': () => FEISHU_RECORDS.map(rowConverter),
+  'mapFields 编码 100 行（编译）': () => DB_ROWS.map(fieldsEncoder),
+  'groupByAppTokenAndTableId 1000 条消息': () => groupByAppTokenAndTableId(GROUP_ITEMS),
+  'computeFeishuSignature': () => computeFeishuSignature('1700000000', 'nonce', ENCRYPT_KEY, RAW_BODY),
+};
+
+console.table(Object.fromEntries(
+  Object.entries(syncCases).map(([name, fn]) => [name, { 'bytes/op': bytesPerOp(fn) }])
+));
+
+// —— 基准 ——
+
+Deno.bench({
+  name: 'transformFieldValue（结构探测）',
+  group: 'field-transform',
+  baseline: true,
+  fn() {
+    for (const type of FIELD_TYPES) transformFieldValue(FEISHU_VALUES[type]);
+  },
+});
+
+Deno.bench({
+  name: 'transformFieldValueByType',
+  group: 'field-transform',
+  fn() {
+    for (const type of FIELD_TYPES) transformFieldValueByType(FEISHU_VALUES[type], type);
+  },
+});
+
+Deno.bench({
+  name: 'getFieldTransformer（已编译）',
+  group: 'field-transform',
+  fn() {
+    for (const [transform, value] of typedTransformers) transform(value);
+  },
+});
+
+Deno.bench({
+  name: '逐格 transformFieldValue，100 条',
+  group: 'row-convert',
+  baseline: true,
+  fn() {
+    for (const record of FEISHU_RECORDS) {
+      const row: Record<string, any> = { record_id: record.record_id };
+      for (const m of MAPPINGS) row[m.db_field] = transformFieldValue(record.fields[m.feishu_field_name]) ?? null;
+    }
+  },
+});
+
+Deno.bench({
+  name: 'compileBitableRowConverter，100 条',
+  group: 'row-convert',
+  fn() {
+    for (const record of FEISHU_RECORDS) rowConverter(record);
+  },
+});
+
+Deno.bench({
+  name: 'mapFields（compileBitableFieldsEncoder），100 行',
+  group: 'row-encode',
+  fn() {
+    for (const row of DB_ROWS) fieldsEncoder(row);
+  },
+});
+
+Deno.bench({
+  name: 'groupByAppTokenAndTableId，1000 条消息',
+  group: 'grouping',
+  fn() {
+    groupByAppTokenAndTableId(GROUP_ITEMS);
+  },
+});
+
+// 改造前的解密实现：每次事件都重新派生并导入密钥，逐字符解码 base64，slice 复制 IV 与密文
+async function decryptFeishuUncached(encrypt: string, encryptKey: string): Promise<any> {
+  const binaryString = atob(encrypt);
+  const raw = new Uint8Array(binaryString.length);
+  for (let i = 0; i < binaryString.length; ++i) {
+    raw[i] = binaryString.charCodeAt(i);
+  }
+  const iv = raw.slice(0, 16);
+  const ciphertext = raw.slice(16);
+  const keyBuffer = createHash('sha256').update(encryptKey, 'utf8').digest();
+  const cryptoKey = await crypto.subtle.importKey('raw', keyBuffer, { name: 'AES-CBC' }, false, ['decrypt']);
+  const decrypted = await crypto.subtle.decrypt({ name: 'AES-CBC', iv }, cryptoKey, ciphertext);
+  return JSON.parse(new TextDecoder('utf-8').decode(new Uint8Array(decrypted)));
+}
+
+Deno.bench({
+  name: 'decrypt：每次导入密钥 + charCodeAt 解码（改造前）',
+  group: 'decrypt',
+  baseline: true,
+  async fn() {
+    await decryptFeishuUncached(ENCRYPTED, ENCRYPT_KEY);
+  },
+});
+
+Deno.bench({
+  name: 'decryptFeishu：缓存 CryptoKey + 原生 base64 + subarray',
+  group: 'decrypt',
+  async fn() {
+    await decryptFeishu(ENCRYPTED, ENCRYPT_KEY);
+  },
+});
+
+Deno.bench({
+  name: 'computeFeishuSignature',
+  group: 'webhook',
+  fn() {
+    computeFeishuSignature('1700000000', 'nonce', ENCRYPT_KEY, RAW_BODY);
+  },
+});
@@ -0,0 +1,60 @@
+// 多维表格消息分组模块
+// upsertDBFromBitable / deleteDBFromBitable 共用：将队列消息按 app_token + table_id 合并为批处理分组
+
+export interface BitableRecordRef {
+  record_id: string;
+  update_time?: number; // 飞书事件中的修改时间（秒，可选）
+}
+
+export interface BitableGroupItem {
+  app_token: string;
+  table_id: string;
+  records: BitableRecordRef[];
+  process_result?: boolean; // 标记该组的处理结果
+  msg_queue_info?: Array<{ msg_id: number; queue_name: string }>; // 批处理时的消息队列信息
+}
+
+/**
+ * 按 app_token 和 table_id 分组合并数据
+ * - 只要 app_token 或 table_id 不同就是新组；两者同时相同的合并为一组批处理
+ * - 组内按 record_id 去重，保留最新的 update_time；msg_queue_info 依次合并
+ * - 不修改输入项，返回的分组 process_result 初始化为 false
+ * @param items 规范化后的消息项
+ * @returns 分组结果（按首次出现的顺序）
+ */
+export function groupByAppTokenAndTableId<T extends BitableGroupItem>(items: T[]): T[] {
+  const groupMap = new Map<string, { group: T; records: Map<string, BitableRecordRef> }>();
+
+  for (const item of items) {
+    const key = `${item.app_token}:${item.table_id}`;
+    let entry = groupMap.get(key);
+    if (!entry) {
+      // 创建新的分组，初始化process_result为false
+      entry = {
+        group: { ...item, process_result: false, records: [], msg_queue_info: undefined },
+        records: new Map()
+      };
+      groupMap.set(key, entry);
+    }
+
+    for (const record of item.records) {
+      const existing = entry.records.get(record.record_id);
+      if (!existing) {
+        entry.records.set(record.record_id, { ...record });
+      } else if ((record.update_time ?? 0) > (existing.update_time ?? 0)) {
+        // 保留最新的修改时间
+        existing.update_time = record.update_time;
+      }
+    }
+
+    // 合并msg_queue_info
+    if (item.msg_queue_info) {
+      (entry.group.msg_queue_info ??= []).push(...item.msg_queue_info);
+    }
+  }
+
+  return Array.from(groupMap.values(), ({ group, records }) => {
+    group.records = Array.from(records.values());
+    return group;
+  });
+}
@@ -0,0 +1,74 @@
+// 并发与限流工具模块
+// 提供有限并发执行、令牌桶限流与后台任务登记，供批量调用外部 API / 数据库时复用
+
+/**
+ * 以有限并发执行异步任务，结果顺序与输入一致
+ * @param items - 任务输入
+ * @param limit - 最大并发数
+ * @param worker - 处理单个输入的异步函数
+ * @returns 按输入顺序排列的结果
+ */
+export async function mapWithConcurrency<T, R>(
+  items: T[],
+  limit: number,
+  worker: (item: T, index: number) => Promise<R>
+): Promise<R[]> {
+  const results = new Array<R>(items.length);
+  let next = 0;
+  const runners = Array.from({ length: Math.max(1, Math.min(limit, items.length)) }, async () => {
+    while (next < items.length) {
+      const index = next++;
+      results[index] = await worker(items[index], index);
+    }
+  });
+  await Promise.all(runners);
+  return results;
+}
+
+export function sleep(ms: number): Promise<void> {
+  return new Promise(resolve => setTimeout(resolve, ms));
+}
+
+declare const EdgeRuntime: { waitUntil(promise: Promise<unknown>): void } | undefined;
+
+/**
+ * 在响应返回后继续执行的后台任务
+ * - Edge Runtime 中通过 EdgeRuntime.waitUntil 登记，isolate 会等待任务完成后再回收
+ * - 其他环境（本地脚本、基准测试）中仅避免未处理的 rejection
+ */
+export function runInBackground(promise: Promise<unknown>): void {
+  const tracked = promise.catch(error => console.error('后台任务失败:', error));
+  if (typeof EdgeRuntime !== 'undefined') {
+    EdgeRuntime.waitUntil(tracked);
+  }
+}
+
+/**
+ * 令牌桶限流器
+ * - 每秒补充 rate 个令牌，最多积累 capacity 个（允许的突发量）
+ * - take() 在没有令牌时等待，直到补充出一个令牌
+ */
+export class TokenBucket {
+  private tokens: number;
+  private lastRefill: number;
+
+  constructor(private readonly rate: number, private readonly capacity: number = rate) {
+    this.tokens = capacity;
+    this.lastRefill = Date.now();
+  }
+
+  private refill(): void {
+    const now = Date.now();
+    this.tokens = Math.min(this.capacity, this.tokens + (now - this.lastRefill) / 1000 * this.rate);
+    this.lastRefill = now;
+  }
+
+  async take(): Promise<void> {
+    this.refill();
+    while (this.tokens < 1) {
+      await sleep(Math.ceil((1 - this.tokens) / this.rate * 1000));
+      this.refill();
+    }
+    this.tokens -= 1;
+  }
+}
@@ -1,40 +1,53 @@
 // 飞书加密解密工具模块
 import { createHash } from "node:crypto";
+import { Buffer } from "node:buffer";
 
-export function deriveKey(encryptKey: string): ArrayBuffer {
-  return createHash("sha256").update(encryptKey, "utf8").digest();
+// 每个 encrypt key 只派生并导入一次 AES 密钥（isolate 内复用）
+const cryptoKeys = new Map<string, Promise<CryptoKey>>();
+
+function getDecryptKey(encryptKey: string): Promise<CryptoKey> {
+  let key = cryptoKeys.get(encryptKey);
+  if (!key) {
+    key = crypto.subtle.digest("SHA-256", new TextEncoder().encode(encryptKey))
+      .then(keyBuffer => crypto.subtle.importKey("raw", keyBuffer, { name: "AES-CBC" }, false, ["decrypt"]));
+    // 导入失败时不缓存，下次重新尝试
+    key.catch(() => cryptoKeys.delete(encryptKey));
+    cryptoKeys.set(encryptKey, key);
+  }
+  return key;
 }
 
+// base64 → Uint8Array：优先使用原生 Uint8Array.fromBase64，否则使用 node:buffer
+const fromBase64: (encoded: string) => Uint8Array =
+  typeof (Uint8Array as any).fromBase64 === "function"
+    ? (encoded) => (Uint8Array as any).fromBase64(encoded)
+    : (encoded) => Buffer.from(encoded, "base64");
+
+const textDecoder = new TextDecoder("utf-8");
+
 // 飞书开放平台事件解密
 export async function decryptFeishu(encrypt: string, encryptKey: string): Promise<any> {
   if (!encrypt || typeof encrypt !== "string") {
     throw new Error("Invalid encrypt payload");
   }
 
-  const binaryString = atob(encrypt);
-  const raw = new Uint8Array(binaryString.length);
-  for (let i = 0; i < binaryString.length; ++i) {
-    raw[i] = binaryString.charCodeAt(i);
-  }
+  const raw = fromBase64(encrypt);
 
   if (raw.length <= 16) {
     throw new Error("Invalid ciphertext: too short");
   }
 
-  const iv = raw.slice(0, 16);
-  const ciphertext = raw.slice(16);
-  const keyBuffer = deriveKey(encryptKey);
-
-  const cryptoKey = await crypto.subtle.importKey("raw", keyBuffer, {
-    name: "AES-CBC"
-  }, false, ["decrypt"]);
+  // 前 16 字节为 IV，其余为密文（使用视图，不复制）
+  const iv = raw.subarray(0, 16);
+  const ciphertext = raw.subarray(16);
+  const cryptoKey = await getDecryptKey(encryptKey);
 
   const decryptedBuffer = await crypto.subtle.decrypt({
     name: "AES-CBC",
     iv
   }, cryptoKey, ciphertext);
 
-  const text = new TextDecoder("utf-8").decode(new Uint8Array(decryptedBuffer));
+  const text = textDecoder.decode(decryptedBuffer);
   
   let json;
   try {
@@ -44,4 +57,26 @@ export async function decryptFeishu(encrypt: string, encryptKey: string): Promis
   }
   
   return json;
-}
\ No newline at end of file
+}
+
+/**
+ * 计算飞书事件签名：sha256(timestamp + nonce + encryptKey + 原始请求体) 的十六进制摘要
+ * @param timestamp X-Lark-Request-Timestamp 请求头
+ * @param nonce X-Lark-Request-Nonce 请求头
+ * @param encryptKey 飞书后台配置的 Encrypt Key
+ * @param rawBody 原始请求体（未经解析）
+ * @returns 应与 X-Lark-Signature 请求头一致的签名
+ */
+export function computeFeishuSignature(
+  timestamp: string | null,
+  nonce: string | null,
+  encryptKey: string,
+  rawBody: Uint8Array
+): string {
+  return createHash("sha256")
+    .update(String(timestamp ?? ""), "utf8")
+    .update(String(nonce ?? ""), "utf8")
+    .update(encryptKey, "utf8")
+    .update(rawBody)
+    .digest("hex");
+}
@@ -0,0 +1,97 @@
+// 飞书事件路由模块
+// feishu-webhook（同步模式）与 feishu-webhook-worker（ack-first 模式的批量消费者）共用：
+// 将解密后的 bitable_record_changed 事件分发为 upsert 队列消息与数据库删除
+// 事件请求体请参考 https://open.feishu.cn/document/docs/bitable-v1/events/bitable_record_changed#bea8b65
+import { deleteRecords } from './supabaseClient.ts';
+import { getMappingByBitable } from './mappingCache.ts';
+import { claimWebhookEvent, releaseWebhookEvent } from './webhookEvents.ts';
+import { enqueueUpsertRecords } from './upsertBatcher.ts';
+
+// ack-first 模式下 webhook 写入原始加密事件的队列，由 feishu-webhook-worker 消费
+export const WEBHOOK_INBOX_QUEUE_NAME = 'webhook_inbox';
+
+/**
+ * 删除飞书中已删除记录对应的数据库行
+ * @returns 'success' 或错误信息
+ */
+async function deleteBitableRecords(app_token: string, table_id: string, recordIds: string[]): Promise<"success" | string> {
+  console.log(`[删除] 开始处理 ${recordIds.length} 条删除记录`);
+
+  // 从映射缓存获取数据库表信息
+  const mappingData = await getMappingByBitable(app_token, table_id);
+  if (!mappingData) {
+    // 未配置映射的表无需删除，视为已处理
+    console.error(`[删除] 未找到映射配置: app_token=${app_token}, table_id=${table_id}`);
+    return 'success';
+  }
+
+  const { db_schema, db_table } = mappingData;
+  console.log(`[删除] 映射结果: db_schema=${db_schema}, db_table=${db_table}`);
+
+  const deleteRows = recordIds.map(record_id => ({ record_id }));
+  const deleteResult = await deleteRecords(`${db_schema}.${db_table}`, deleteRows, 'record_id');
+  if (deleteResult === 'success') {
+    console.log(`[删除] 成功删除 ${deleteRows.length} 条记录`);
+  } else {
+    console.error(`[删除] 删除失败:`, deleteResult);
+  }
+  return deleteResult;
+}
+
+/**
+ * 路由一个解密后的飞书事件
+ * - 重复投递的事件（event_id 已处理过）直接丢弃
+ * - record_added / record_edited：加入 upsert 微批（见 upsertBatcher.ts），等待所在批次发送完成
+ * - record_deleted：按映射删除数据库记录
+ * - 任一步骤失败时释放 event_id，让重试可以再次处理
+ * @param eventBody 解密后的事件
+ * @returns 是否处理完成（重复事件也视为完成）；不抛出异常
+ */
+export async function routeFeishuEvent(eventBody: any): Promise<boolean> {
+  const eventId = eventBody?.header?.event_id;
+  try {
+    if (eventId && !(await claimWebhookEvent(eventId, eventBody.header?.event_type))) {
+      console.log("重复事件，跳过:", eventId);
+      return true;
+    }
+
+    const event = eventBody?.event;
+    const actions: any[] = event?.action_list ?? [];
+    // action 可能: "record_added", "record_deleted", "record_edited"
+    const upsertRecordIds = new Set<string>();
+    const deletedRecordIds = new Set<string>();
+    for (const item of actions) {
+      if (!item?.record_id) continue;
+      if (item.action === "record_added" || item.action === "record_edited") {
+        upsertRecordIds.add(item.record_id);
+      } else if (item.action === "record_deleted") {
+        deletedRecordIds.add(item.record_id);
+      }
+    }
+
+    const tasks: Promise<boolean>[] = [];
+    if (upsertRecordIds.size > 0) {
+      // update_time 为事件中的记录修改时间（秒），下游据此判断缓存的飞书记录是否仍然有效
+      const updateTime = event.update_time;
+      const records = Array.from(upsertRecordIds, record_id => (updateTime ? { record_id, update_time: updateTime } : { record_id }));
+      console.log("加入 upsert 微批，记录数:", records.length);
+      // 批次发送失败时由 upsertBatcher 释放 event_id
+      tasks.push(enqueueUpsertRecords(event.file_token, event.table_id, records, eventId));
+    }
+    if (deletedRecordIds.size > 0) {
+      tasks.push(
+        deleteBitableRecords(event.file_token, event.table_id, Array.from(deletedRecordIds))
+          .then(result => result === 'success')
+      );
+    }
+
+    const results = await Promise.all(tasks);
+    const handled = results.every(Boolean);
+    if (!handled && eventId) await releaseWebhookEvent(eventId);
+    return handled;
+  } catch (error) {
+    console.error("处理飞书事件失败:", eventId, error);
+    if (eventId) await releaseWebhookEvent(eventId);
+    return false;
+  }
+}
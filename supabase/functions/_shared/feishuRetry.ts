@@ -0,0 +1,151 @@
+// 飞书接口重试与熔断模块
+// 按错误码区分限流 / 暂时性错误 / 永久错误：前两者以带抖动的指数退避重试（优先遵循服务端给出的等待时间），
+// 同一多维表格（app_token）连续失败后熔断，暂停本 isolate 内所有 worker 对该应用的调用
+import { sleep } from './concurrency.ts';
+
+/**
+ * 飞书接口错误
+ * - code 为飞书业务错误码（HTTP 层失败且无业务码时为 -1），status 为 HTTP 状态码
+ * - retryAfterMs 为服务端要求的等待时间（来自 x-ogw-ratelimit-reset / Retry-After 响应头）
+ */
+export class FeishuApiError extends Error {
+  constructor(
+    message: string,
+    public readonly code: number,
+    public readonly status: number,
+    public readonly data?: any,
+    public readonly retryAfterMs?: number
+  ) {
+    super(message);
+    this.name = 'FeishuApiError';
+  }
+}
+
+export type FeishuErrorKind = 'rate_limit' | 'transient' | 'permanent';
+
+// 限流错误码：99991400 应用频控，1254290 多维表格请求过于频繁
+const RATE_LIMIT_CODES = new Set([99991400, 1254290]);
+// 暂时性错误码：1254291 写冲突，1254607 数据未就绪，1255040 请求超时
+const TRANSIENT_CODES = new Set([1254291, 1254607, 1255040]);
+
+const MAX_ATTEMPTS = 5;
+const BASE_DELAY_MS = 500;
+const MAX_DELAY_MS = 10_000;
+// 连续失败多少次后熔断，以及熔断的最短时长
+const BREAKER_FAILURE_THRESHOLD = 5;
+const BREAKER_COOLDOWN_MS = 30_000;
+
+/**
+ * 熔断中的错误：调用方应保留消息等待重新投递，而不是视为永久失败
+ */
+export class FeishuCircuitOpenError extends Error {
+  constructor(public readonly key: string, public readonly retryAt: number) {
+    super(`飞书接口熔断中: ${key}，${Math.ceil((retryAt - Date.now()) / 1000)} 秒后恢复`);
+    this.name = 'FeishuCircuitOpenError';
+  }
+}
+
+/**
+ * 判断飞书接口错误的类型
+ * - 网络错误（feishuRequest 包装为 status 0 的 FeishuApiError）、HTTP 5xx 视为暂时性错误
+ * - 其他业务错误码（如权限不足、参数错误）以及 FeishuApiError 以外的异常（如代码或数据错误）均视为永久错误
+ */
+export function classifyFeishuError(error: unknown): FeishuErrorKind {
+  if (error instanceof FeishuApiError) {
+    if (error.status === 429 || RATE_LIMIT_CODES.has(error.code)) return 'rate_limit';
+    if (error.status === 0 || error.status >= 500 || TRANSIENT_CODES.has(error.code)) return 'transient';
+  }
+  return 'permanent';
+}
+
+/**
+ * 是否值得稍后重试（限流、暂时性错误或熔断中）
+ * - 用于决定是否保留队列消息等待重新投递
+ */
+export function isRetryableFeishuError(error: unknown): boolean {
+  return error instanceof FeishuCircuitOpenError || classifyFeishuError(error) !== 'permanent';
+}
+
+interface BreakerState {
+  failures: number;
+  openUntil: number;
+}
+
+const breakers = new Map<string, BreakerState>();
+
+function getBreaker(key: string): BreakerState {
+  let state = breakers.get(key);
+  if (!state) {
+    state = { failures: 0, openUntil: 0 };
+    breakers.set(key, state);
+  }
+  return state;
+}
+
+/**
+ * 暂停到熔断结束；剩余时间超过单次最大等待时直接抛出 FeishuCircuitOpenError
+ */
+async function waitForBreaker(key: string, state: BreakerState): Promise<void> {
+  const remaining = state.openUntil - Date.now();
+  if (remaining <= 0) return;
+  if (remaining > MAX_DELAY_MS) {
+    throw new FeishuCircuitOpenError(key, state.openUntil);
+  }
+  await sleep(remaining);
+}
+
+function openBreaker(key: string, state: BreakerState, durationMs: number): void {
+  const openUntil = Date.now() + durationMs;
+  if (openUntil > state.openUntil) {
+    state.openUntil = openUntil;
+    console.warn(`飞书接口熔断: ${key}，暂停 ${Math.ceil(durationMs / 1000)} 秒`);
+  }
+}
+
+// 全抖动指数退避：在 [0, min(上限, 基数 * 2^attempt)] 内随机
+function backoffDelay(attempt: number): number {
+  return Math.random() * Math.min(MAX_DELAY_MS, BASE_DELAY_MS * 2 ** attempt);
+}
+
+/**
+ * 带重试与熔断地调用飞书接口
+ * - 限流 / 暂时性错误按指数退避重试，服务端返回等待时间（retryAfterMs）时至少等待该时长
+ * - 服务端要求的等待超过单次最大等待，或连续失败达到阈值时熔断，同一 key 的其他调用一并暂停
+ * - 永久错误直接抛出，且不计入熔断
+ * @param key 熔断维度（多维表格 app_token）
+ * @param fn 实际发起请求的函数（每次重试都会重新调用）
+ * @returns fn 的结果
+ * @throws 永久错误、重试耗尽后的最后一个错误，或 FeishuCircuitOpenError
+ */
+export async function withFeishuRetry<T>(key: string, fn: () => Promise<T>): Promise<T> {
+  const state = getBreaker(key);
+  for (let attempt = 0; ; attempt++) {
+    await waitForBreaker(key, state);
+    try {
+      const result = await fn();
+      state.failures = 0;
+      return result;
+    } catch (error) {
+      const kind = classifyFeishuError(error);
+      if (kind === 'permanent') throw error;
+
+      state.failures++;
+      const retryAfterMs = error instanceof FeishuApiError ? error.retryAfterMs : undefined;
+      if (retryAfterMs !== undefined && retryAfterMs > MAX_DELAY_MS) {
+        openBreaker(key, state, retryAfterMs);
+      } else if (state.failures >= BREAKER_FAILURE_THRESHOLD) {
+        openBreaker(key, state, Math.max(BREAKER_COOLDOWN_MS, retryAfterMs ?? 0));
+      } else if (kind === 'rate_limit' && retryAfterMs !== undefined) {
+        // 限流时让同一应用的其他调用一起等待到重置时间
+        openBreaker(key, state, retryAfterMs);
+      }
+
+      if (attempt + 1 >= MAX_ATTEMPTS) throw error;
+      const delay = Math.max(backoffDelay(attempt), retryAfterMs ?? 0);
+      console.warn(`飞书接口${kind === 'rate_limit' ? '限流' : '暂时性错误'}，${Math.round(delay)}ms 后第 ${attempt + 1} 次重试: ${key}`, (error as Error)?.message);
+      if (state.openUntil <= Date.now()) {
+        await sleep(delay);
+      }
+    }
+  }
+}
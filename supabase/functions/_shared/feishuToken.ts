@@ -0,0 +1,124 @@
+// 飞书 tenant_access_token 管理模块
+// 三级缓存：isolate 内存 → 数据库表 feishu_tenant_tokens → 飞书鉴权接口
+// 距过期不足 REFRESH_AHEAD_MS 时提前刷新，所有访问飞书的函数共享同一个 token
+import { supabaseClient } from './supabaseClient.ts';
+import { getAppId, getAppSecret } from './getDenoEnv.ts';
+
+const TOKEN_URL = 'https://open.feishu.cn/open-apis/auth/v3/tenant_access_token/internal';
+// 提前刷新的时间窗口（飞书 token 有效期 2 小时）
+const REFRESH_AHEAD_MS = 10 * 60 * 1000;
+
+interface CachedToken {
+  token: string;
+  expiresAt: number;  // 过期时间（毫秒时间戳）
+}
+
+let memoryToken: CachedToken | null = null;
+// 同一 isolate 内的并发刷新共用一个请求
+let refreshing: Promise<CachedToken> | null = null;
+
+function isFresh(cached: CachedToken | null): cached is CachedToken {
+  return !!cached && cached.expiresAt - Date.now() > REFRESH_AHEAD_MS;
+}
+
+// 从数据库读取其他函数已缓存的 token
+async function loadStoredToken(appId: string): Promise<CachedToken | null> {
+  const { data, error } = await supabaseClient
+    .from('feishu_tenant_tokens')
+    .select('tenant_access_token, expires_at')
+    .eq('app_id', appId)
+    .maybeSingle();
+
+  if (error) {
+    console.warn('[feishuToken] 读取缓存 token 失败:', error.message);
+    return null;
+  }
+  if (!data) return null;
+  return { token: data.tenant_access_token, expiresAt: new Date(data.expires_at).getTime() };
+}
+
+// 向飞书请求新的 token 并写回数据库
+async function requestNewToken(appId: string): Promise<CachedToken> {
+  const response = await fetch(TOKEN_URL, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ app_id: appId, app_secret: getAppSecret() })
+  });
+  const data = await response.json();
+  if (data.code !== 0) {
+    throw new Error(`获取 tenant_access_token 失败: code=${data.code}, msg=${data.msg}`);
+  }
+
+  const cached = { token: data.tenant_access_token, expiresAt: Date.now() + data.expire * 1000 };
+  const { error } = await supabaseClient
+    .from('feishu_tenant_tokens')
+    .upsert({
+      app_id: appId,
+      tenant_access_token: cached.token,
+      expires_at: new Date(cached.expiresAt).toISOString(),
+      updated_at: new Date().toISOString()
+    }, { onConflict: 'app_id' });
+  if (error) {
+    // 写缓存失败不影响本次使用
+    console.warn('[feishuToken] 写入缓存 token 失败:', error.message);
+  }
+
+  console.log(`[feishuToken] 已刷新 token，过期时间: ${new Date(cached.expiresAt).toISOString()}`);
+  return cached;
+}
+
+async function refreshToken(): Promise<CachedToken> {
+  const appId = getAppId();
+  const stored = await loadStoredToken(appId);
+  if (isFresh(stored)) return stored;
+  return await requestNewToken(appId);
+}
+
+/**
+ * 获取飞书 tenant_access_token
+ * - 优先使用内存与数据库中的缓存，临近过期时提前刷新
+ * @returns tenant_access_token
+ * @throws 飞书鉴权接口返回错误时抛出
+ */
+export async function getTenantAccessToken(): Promise<string> {
+  if (isFresh(memoryToken)) return memoryToken.token;
+
+  if (!refreshing) {
+    refreshing = refreshToken().finally(() => {
+      refreshing = null;
+    });
+  }
+  try {
+    memoryToken = await refreshing;
+  } catch (error) {
+    // 提前刷新失败但旧 token 尚未过期时继续使用旧 token
+    if (memoryToken && memoryToken.expiresAt > Date.now()) {
+      console.warn('[feishuToken] 刷新失败，继续使用未过期的 token:', error);
+      return memoryToken.token;
+    }
+    throw error;
+  }
+  return memoryToken.token;
+}
+
+/**
+ * 作废被飞书拒绝的 token（已失效 / 已过期，如应用密钥轮换或提前吊销后）
+ * - 清除内存缓存，并删除数据库中仍为该 token 的缓存行，下一次 getTenantAccessToken 会向飞书重新获取
+ * - 只删除与 rejectedToken 相同的行，避免误删其他函数刚刷新的新 token
+ * @param rejectedToken 被拒绝的 token；缺省时作废当前缓存的 token
+ */
+export async function invalidateTenantToken(rejectedToken?: string): Promise<void> {
+  const token = rejectedToken ?? memoryToken?.token;
+  if (!token) return;
+  if (memoryToken?.token === token) memoryToken = null;
+
+  const { error } = await supabaseClient
+    .from('feishu_tenant_tokens')
+    .delete()
+    .eq('app_id', getAppId())
+    .eq('tenant_access_token', token);
+  if (error) {
+    console.warn('[feishuToken] 删除失效 token 失败:', error.message);
+  }
+  console.log('[feishuToken] 已作废被飞书拒绝的 token');
+}
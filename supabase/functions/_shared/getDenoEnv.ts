@@ -29,4 +29,28 @@ export function getSupabaseServiceRoleKey(): string {
   const key = Deno.env.get('SUPABASE_SERVICE_ROLE_KEY');
   if (!key) throw new Error("缺少 Supabase Service Role Key");
   return key;
-}
\ No newline at end of file
+}
+
+// 可选的非负整数配置，未设置或不合法时使用默认值
+function getNonNegativeInt(name: string, defaultValue: number): number {
+  const raw = Deno.env.get(name);
+  if (raw === undefined || raw === '') return defaultValue;
+  const value = Number(raw);
+  return Number.isInteger(value) && value >= 0 ? value : defaultValue;
+}
+
+// webhook 微批窗口（毫秒），0 表示不攒批、逐事件发送
+export function getWebhookBatchWindowMs(): number {
+  return getNonNegativeInt('FEISHU_WEBHOOK_BATCH_WINDOW_MS', 1000);
+}
+
+// webhook 微批的记录数上限，达到后立即发送
+export function getWebhookBatchMaxRecords(): number {
+  return getNonNegativeInt('FEISHU_WEBHOOK_BATCH_MAX_RECORDS', 500);
+}
+
+// webhook ack-first 模式：只校验签名并写入 webhook_inbox 队列，由 feishu-webhook-worker 异步处理
+export function getWebhookAckFirst(): boolean {
+  const value = Deno.env.get('FEISHU_WEBHOOK_ACK_FIRST');
+  return value === 'true' || value === '1';
+}
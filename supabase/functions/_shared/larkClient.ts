@@ -1,20 +1,131 @@
 // Lark (飞书) 客户端模块
-import Lark from "npm:@larksuiteoapi/node-sdk";
-import { getAppId, getAppSecret } from './getDenoEnv.ts';
-
-// 初始化 Lark 客户端（SDK 会自动管理租户 token）
-export const larkClient = new Lark.Client({
-  appId: getAppId(),
-  appSecret: getAppSecret(),
-  disableTokenCache: false,
-  // 添加更多配置选项以确保稳定性
-  domain: 'https://open.feishu.cn'
-});
+// 基于原生 fetch 的精简多维表格客户端，只覆盖本项目用到的接口，避免在冷启动路径上加载完整的 Lark SDK
+import { TokenBucket } from './concurrency.ts';
+import { LruCache } from './lruCache.ts';
+import { getTenantAccessToken, invalidateTenantToken } from './feishuToken.ts';
+import { FeishuApiError, withFeishuRetry } from './feishuRetry.ts';
+
+const FEISHU_API_BASE = 'https://open.feishu.cn/open-apis';
+
+// 解析服务端要求的等待时间（两个响应头的单位均为秒）
+function parseRetryAfter(headers: Headers): number | undefined {
+  const value = headers.get('x-ogw-ratelimit-reset') ?? headers.get('retry-after');
+  if (value === null) return undefined;
+  const seconds = Number(value);
+  return Number.isFinite(seconds) && seconds >= 0 ? seconds * 1000 : undefined;
+}
+
+// token 无效 / 已过期的错误码：作废缓存的 token 后重新获取并重试一次
+const AUTH_TOKEN_ERROR_CODES = new Set([99991661, 99991663, 99991668]);
+
+/**
+ * 调用飞书开放平台接口（自动携带共享的 tenant_access_token）
+ * - 飞书报告 token 无效或过期时，作废缓存的 token，重新获取后重试一次
+ * @param method HTTP 方法
+ * @param path 接口路径（/open-apis 之后的部分）
+ * @param body 请求体（可选）
+ * @param tokenRetried 是否已因 token 失效重试过（内部使用）
+ * @returns 飞书响应 JSON（code 为 0）
+ * @throws FeishuApiError 网络失败（status 为 0）、HTTP 失败或 code 非 0 时抛出
+ */
+async function feishuRequest(method: string, path: string, body?: unknown, tokenRetried = false): Promise<any> {
+  const token = await getTenantAccessToken();
+  let response: Response;
+  try {
+    response = await fetch(`${FEISHU_API_BASE}${path}`, {
+      method,
+      headers: {
+        'Authorization': `Bearer ${token}`,
+        'Content-Type': 'application/json; charset=utf-8'
+      },
+      body: body === undefined ? undefined : JSON.stringify(body)
+    });
+  } catch (error) {
+    // 网络层失败（连接 / DNS / 超时）没有 HTTP 状态码，以 status 0 标记为可重试
+    throw new FeishuApiError(`飞书接口请求失败: ${(error as Error)?.message ?? error}`, -1, 0);
+  }
+
+  let data: any;
+  try {
+    data = await response.json();
+  } catch {
+    throw new FeishuApiError(`飞书接口返回非 JSON 响应: HTTP ${response.status}`, -1, response.status, undefined, parseRetryAfter(response.headers));
+  }
+  if (!response.ok || data?.code !== 0) {
+    if (!tokenRetried && AUTH_TOKEN_ERROR_CODES.has(data?.code)) {
+      console.warn(`飞书 token 失效（code=${data.code}），重新获取后重试: ${path}`);
+      await invalidateTenantToken(token);
+      return await feishuRequest(method, path, body, true);
+    }
+    throw new FeishuApiError(data?.msg ?? `HTTP ${response.status}`, data?.code ?? -1, response.status, data, parseRetryAfter(response.headers));
+  }
+  return data;
+}
+
+interface BitableRecordRequest {
+  path: { app_token: string; table_id: string };
+  data: Record<string, any>;
+}
+
+// user_id_type / client_token 等参数放在 query 中，其余放在请求体中
+function recordsPath(req: BitableRecordRequest, action: string, clientToken?: string): string {
+  const { app_token, table_id } = req.path;
+  const params = new URLSearchParams();
+  if (req.data.user_id_type) params.set('user_id_type', req.data.user_id_type);
+  if (clientToken) params.set('client_token', clientToken);
+  const query = params.toString();
+  return `/bitable/v1/apps/${encodeURIComponent(app_token)}/tables/${encodeURIComponent(table_id)}/records/${action}${query ? `?${query}` : ''}`;
+}
+
+function withoutUserIdType(data: Record<string, any>): Record<string, any> {
+  const { user_id_type: _ignored, ...rest } = data;
+  return rest;
+}
+
+/**
+ * 多维表格客户端
+ * - 记录接口：batchGet / batchCreate / batchUpdate / batchDelete，参数形如 { path: { app_token, table_id }, data }
+ * - 字段接口：listFields 自动翻页返回全部字段
+ * - 所有调用按 app_token 经过重试与熔断（见 feishuRetry.ts）；batchCreate 的重试共用同一 client_token，避免重复创建
+ * - batchGet 可传入令牌桶，每次尝试（含重试）都先取令牌，重试不会超出限流配额
+ */
+export const bitableClient = {
+  batchGet: (req: BitableRecordRequest, limiter?: TokenBucket) =>
+    withFeishuRetry(req.path.app_token, async () => {
+      await limiter?.take();
+      return await feishuRequest('POST', recordsPath({ ...req, data: {} }, 'batch_get'), req.data);
+    }),
+  batchCreate: (req: BitableRecordRequest) => {
+    const clientToken = crypto.randomUUID();
+    return withFeishuRetry(req.path.app_token, () =>
+      feishuRequest('POST', recordsPath(req, 'batch_create', clientToken), withoutUserIdType(req.data)));
+  },
+  batchUpdate: (req: BitableRecordRequest) =>
+    withFeishuRetry(req.path.app_token, () =>
+      feishuRequest('POST', recordsPath(req, 'batch_update'), withoutUserIdType(req.data))),
+  batchDelete: (req: BitableRecordRequest) =>
+    withFeishuRetry(req.path.app_token, () =>
+      feishuRequest('POST', recordsPath(req, 'batch_delete'), withoutUserIdType(req.data))),
+
+  async listFields(app_token: string, table_id: string): Promise<any[]> {
+    const items: any[] = [];
+    let pageToken: string | undefined;
+    do {
+      let path = `/bitable/v1/apps/${encodeURIComponent(app_token)}/tables/${encodeURIComponent(table_id)}/fields?page_size=100`;
+      if (pageToken) path += `&page_token=${encodeURIComponent(pageToken)}`;
+      const data = await withFeishuRetry(app_token, () => feishuRequest('GET', path));
+      items.push(...(data?.data?.items ?? []));
+      pageToken = data?.data?.has_more ? data.data.page_token : undefined;
+    } while (pageToken);
+    return items;
+  }
+};
 
 // 飞书多维表格记录接口
 export interface FeishuBitableRecord {
   record_id: string;
   fields: Record<string, any>;
+  last_modified_time?: number; // 最后修改时间戳（毫秒，开启 automatic_fields 时返回）
 }
 
 // 飞书批量创建记录API响应接口
@@ -34,57 +145,258 @@ export interface FeishuBatchCreateResponse {
   record_id: string;         // 提取的第一个记录的record_id，用于向后兼容
 }
 
+// 飞书 batchGet 单次最多100条
+const BATCH_GET_SIZE = 100;
+// 默认并发数与每秒请求数（飞书多维表格单应用接口频控约 20 次/秒，留出余量给其他调用）
+const DEFAULT_FETCH_CONCURRENCY = 4;
+const DEFAULT_REQUESTS_PER_SECOND = 10;
+
+// 同一速率共用一个令牌桶，使同一 isolate 内的所有调用共享配额
+const rateLimiters = new Map<number, TokenBucket>();
+
+function getRateLimiter(requestsPerSecond: number): TokenBucket {
+  let limiter = rateLimiters.get(requestsPerSecond);
+  if (!limiter) {
+    limiter = new TokenBucket(requestsPerSecond);
+    rateLimiters.set(requestsPerSecond, limiter);
+  }
+  return limiter;
+}
+
+export interface FetchBitableRecordsOptions {
+  concurrency?: number;        // 同时进行的 batchGet 请求数，默认 4
+  requestsPerSecond?: number;  // 每秒最多发起的 batchGet 请求数，默认 10
+  automaticFields?: boolean;   // 是否返回创建/修改时间与人员等自动字段，默认 false
+  modifiedSince?: Record<string, number>; // record_id → 已知的最后修改时间（毫秒），缓存不早于该时间的记录可直接复用
+}
+
+// 记录缓存：同一 isolate 内短时间重复的 record_edited 事件不再重复 batchGet
+const RECORD_CACHE_MAX_ENTRIES = 2000;
+const RECORD_CACHE_TTL_MS = 5 * 60 * 1000;
+// 比较本地获取时间与飞书时间戳时允许的时钟偏差
+const CLOCK_SKEW_MS = 2000;
+
+interface CachedRecord {
+  record: FeishuBitableRecord;  // batchGet 返回的记录
+  fetchedAt: number;            // 发起请求时的本地时间
+}
+
+const recordCache = new LruCache<string, CachedRecord>(RECORD_CACHE_MAX_ENTRIES, RECORD_CACHE_TTL_MS);
+
+// 是否返回自动字段会改变记录内容，作为键的一部分
+function recordCacheKey(app_token: string, table_id: string, record_id: string, automaticFields: boolean): string {
+  return `${app_token}/${table_id}/${record_id}${automaticFields ? '#auto' : ''}`;
+}
+
 /**
- * 从飞书多维表格批量获取记录
+ * 读取缓存记录
+ * - 仅当调用方提供了已知修改时间，且缓存的 last_modified_time 或获取时间不早于它时命中
+ */
+function getCachedRecord(key: string, knownModifiedTime?: number): FeishuBitableRecord | undefined {
+  if (knownModifiedTime == null) return undefined;
+  const entry = recordCache.get(key);
+  if (!entry) return undefined;
+  const fresh = (entry.record.last_modified_time ?? 0) >= knownModifiedTime ||
+    entry.fetchedAt - CLOCK_SKEW_MS >= knownModifiedTime;
+  return fresh ? entry.record : undefined;
+}
+
+/**
+ * 获取一批（最多100条）记录并写入缓存
+ * - 权限不足（4001254302/4001254303）时打印并返回空数组，其他错误抛出
+ */
+async function fetchRecordChunk(
+  app_token: string,
+  table_id: string,
+  batchIds: string[],
+  limiter: TokenBucket,
+  automaticFields: boolean
+): Promise<FeishuBitableRecord[]> {
+  // 首次尝试前的本地时间；重试时实际请求更晚，按此判断新鲜度偏保守
+  const fetchedAt = Date.now();
+  try {
+    const resp = await bitableClient.batchGet({
+      path: { app_token, table_id },
+      data: {
+        record_ids: batchIds,
+        user_id_type: 'open_id',
+        with_shared_url: false,
+        automatic_fields: automaticFields,
+      },
+    }, limiter);
+    const records = (resp?.data?.records ?? []) as FeishuBitableRecord[];
+    if (records.length === 0 && batchIds.length > 0) {
+      console.warn(`fetchBitableRecords 权限或数据问题: app_token=${app_token}, table_id=${table_id}, 请求=${batchIds.length}, 返回=0`);
+    }
+    for (const record of records) {
+      recordCache.set(recordCacheKey(app_token, table_id, record.record_id, automaticFields), { record, fetchedAt });
+    }
+    return records;
+  } catch (e: any) {
+    const errCode = e?.code;
+    if (errCode === 4001254302 || errCode === 4001254303) {
+      console.warn('飞书 batchGet 权限不足:', JSON.stringify(e?.data ?? e, null, 2));
+      // 权限问题仅打印，继续处理下一批
+      return [];
+    }
+    if (e?.data) {
+      console.error('飞书表格 batchGet 失败:', JSON.stringify(e.data, null, 2));
+    } else {
+      console.error('飞书 batchGet 异常:', e);
+    }
+    throw e;
+  }
+}
+
+// 进行中的 batchGet：同一 isolate 内并发请求同一条记录时共用一次请求（single-flight）
+interface InflightRecord {
+  record: Promise<FeishuBitableRecord | undefined>;
+  startedAt: number;  // 登记时的本地时间（不晚于实际发起请求的时间）
+}
+
+const inflightRecords = new Map<string, InflightRecord>();
+
+/**
+ * 获取一批记录（复用缓存并合并进行中的请求）
+ * - 缓存中不早于已知修改时间的记录直接返回
+ * - 进行中的请求仅当调用方提供了已知修改时间，且请求开始时间不早于它时才共用（与 getCachedRecord 的规则一致），
+ *   否则该请求可能返回修改前的数据，需要重新获取
+ * - 其余记录发起一次 batchGet；必须在发起请求前同步登记，才能被随后到达的并发调用看到
+ * - 结果按 batchIds 的顺序返回
+ */
+async function loadRecordChunk(
+  app_token: string,
+  table_id: string,
+  batchIds: string[],
+  limiter: TokenBucket,
+  automaticFields: boolean,
+  modifiedSince?: Record<string, number>
+): Promise<FeishuBitableRecord[]> {
+  const resolved = new Map<string, FeishuBitableRecord | Promise<FeishuBitableRecord | undefined>>();
+  const toFetch: string[] = [];
+  let cacheHits = 0;
+  let joined = 0;
+  for (const record_id of batchIds) {
+    const key = recordCacheKey(app_token, table_id, record_id, automaticFields);
+    const knownModifiedTime = modifiedSince?.[record_id];
+    const cached = getCachedRecord(key, knownModifiedTime);
+    if (cached) {
+      resolved.set(record_id, cached);
+      cacheHits++;
+      continue;
+    }
+    const shared = inflightRecords.get(key);
+    if (shared && knownModifiedTime != null && shared.startedAt - CLOCK_SKEW_MS >= knownModifiedTime) {
+      resolved.set(record_id, shared.record);
+      joined++;
+    } else {
+      toFetch.push(record_id);
+    }
+  }
+  if (cacheHits > 0 || joined > 0) {
+    console.log(`fetchBitableRecords 缓存命中=${cacheHits}, 合并进行中的请求=${joined}, 新请求=${toFetch.length}: app_token=${app_token}, table_id=${table_id}`);
+  }
+
+  if (toFetch.length > 0) {
+    const startedAt = Date.now();
+    const fetched = fetchRecordChunk(app_token, table_id, toFetch, limiter, automaticFields);
+    const byId = fetched.then(records => new Map(records.map(r => [r.record_id, r])));
+    const keys = toFetch.map(record_id => recordCacheKey(app_token, table_id, record_id, automaticFields));
+    const registered = toFetch.map((record_id, i) => {
+      const entry: InflightRecord = { record: byId.then(map => map.get(record_id)), startedAt };
+      // 失败由发起方抛出，共享方在 await 时自行处理
+      entry.record.catch(() => {});
+      inflightRecords.set(keys[i], entry);
+      resolved.set(record_id, entry.record);
+      return entry;
+    });
+    fetched.finally(() => {
+      keys.forEach((key, i) => {
+        if (inflightRecords.get(key) === registered[i]) inflightRecords.delete(key);
+      });
+    }).catch(() => {});
+    // 自己发起的请求失败时直接抛出
+    await fetched;
+  }
+
+  const records = await Promise.all(batchIds.map(record_id => resolved.get(record_id)));
+  return records.filter((r): r is FeishuBitableRecord => !!r);
+}
+
+/**
+ * 从飞书多维表格流式获取记录
+ * - 按100条/批拆分，每获取到一批即 yield；批次之间与批内记录均保持请求顺序
+ * - 最多预取 concurrency 批，调用方处理当前批时后续批仍在获取；所有请求经过令牌桶限流
+ * - batch_get 不支持按字段名裁剪，返回记录的全部字段；自动字段需显式开启 automaticFields
+ * - 传入 modifiedSince 时，缓存中不早于已知修改时间的记录直接返回，不再请求（缓存按是否含自动字段区分）
+ * - 其他调用正在获取的同一记录，若该请求开始时间不早于已知修改时间，则不重复请求而是等待该请求的结果
+ * - 限流 / 暂时性错误由 bitableClient 自动重试；熔断中抛出 FeishuCircuitOpenError
  * @param app_token 飞书应用token
  * @param table_id 表格ID
  * @param record_ids 需要获取的记录ID数组
- * @returns 飞书表格记录数组
+ * @param options 并发与限流配置
+ * @returns 逐批产出飞书表格记录数组的异步生成器
  */
-export async function fetchBitableRecords(app_token: string, table_id: string, record_ids: string[]): Promise<FeishuBitableRecord[]> {
+export async function* fetchBitableRecordsStream(
+  app_token: string,
+  table_id: string,
+  record_ids: string[],
+  options: FetchBitableRecordsOptions = {}
+): AsyncGenerator<FeishuBitableRecord[]> {
   // 入参最小校验
   if (!app_token || !table_id || !Array.isArray(record_ids) || record_ids.length === 0) {
-    console.log(`fetchBitableRecords 获取记录: app_token=${app_token}, table_id=${table_id}, 记录数=0`);
-    return [];
+    return;
   }
 
-  const CHUNK_SIZE = 100; // 飞书 batchGet 建议一次最多100条
-  const allRecords: FeishuBitableRecord[] = [];
+  const concurrency = Math.max(1, options.concurrency ?? DEFAULT_FETCH_CONCURRENCY);
+  const limiter = getRateLimiter(options.requestsPerSecond ?? DEFAULT_REQUESTS_PER_SECOND);
+  const automaticFields = options.automaticFields ?? false;
 
-  for (let i = 0; i < record_ids.length; i += CHUNK_SIZE) {
-    const batchIds = record_ids.slice(i, i + CHUNK_SIZE);
-    try {
-      const resp = await larkClient.bitable.v1.appTableRecord.batchGet({
-        path: { app_token, table_id },
-        data: {
-          record_ids: batchIds,
-          user_id_type: 'open_id',
-          with_shared_url: false,
-          automatic_fields: true,
-        },
-      });
-      const records = (resp?.data?.records ?? []) as FeishuBitableRecord[];
-      if (records.length === 0 && batchIds.length > 0) {
-        console.warn(`fetchBitableRecords 权限或数据问题: app_token=${app_token}, table_id=${table_id}, 请求=${batchIds.length}, 返回=0`);
-      }
-      allRecords.push(...records);
-    } catch (e: any) {
-      const errCode = e?.response?.data?.code ?? e?.code;
-      if (errCode === 4001254302 || errCode === 4001254303) {
-        console.warn('飞书 batchGet 权限不足:', JSON.stringify(e?.response?.data ?? e, null, 2));
-        // 权限问题仅打印，继续处理下一批
-        continue;
-      } else {
-        if (e?.response?.data) {
-          console.error('飞书表格 batchGet 失败:', JSON.stringify(e.response.data, null, 2));
-        } else {
-          console.error('飞书 batchGet 异常:', e);
-        }
-        throw e;
-      }
+  // 按请求顺序分批；缓存命中的记录在各批内直接返回，只对其余记录发起 batchGet
+  const chunks: string[][] = [];
+  for (let i = 0; i < record_ids.length; i += BATCH_GET_SIZE) {
+    chunks.push(record_ids.slice(i, i + BATCH_GET_SIZE));
+  }
+
+  const pending: Promise<FeishuBitableRecord[]>[] = [];
+  let next = 0;
+  const prefetch = () => {
+    while (next < chunks.length && pending.length < concurrency) {
+      const request = loadRecordChunk(app_token, table_id, chunks[next++], limiter, automaticFields, options.modifiedSince);
+      // 预取的请求可能在调用方提前结束迭代后才失败，避免产生未处理的 rejection
+      request.catch(() => {});
+      pending.push(request);
     }
+  };
+
+  prefetch();
+  while (pending.length > 0) {
+    const records = await pending.shift()!;
+    prefetch();
+    yield records;
+  }
+}
+
+/**
+ * 从飞书多维表格批量获取记录
+ * - 汇总 fetchBitableRecordsStream 的所有批次，结果保持请求顺序
+ * @param app_token 飞书应用token
+ * @param table_id 表格ID
+ * @param record_ids 需要获取的记录ID数组
+ * @param options 并发与限流配置
+ * @returns 飞书表格记录数组
+ */
+export async function fetchBitableRecords(
+  app_token: string,
+  table_id: string,
+  record_ids: string[],
+  options: FetchBitableRecordsOptions = {}
+): Promise<FeishuBitableRecord[]> {
+  const allRecords: FeishuBitableRecord[] = [];
+  for await (const records of fetchBitableRecordsStream(app_token, table_id, record_ids, options)) {
+    allRecords.push(...records);
   }
 
   console.log(`fetchBitableRecords 获取记录: app_token=${app_token}, table_id=${table_id}, 记录数=${allRecords.length}`);
   return allRecords;
-}
\ No newline at end of file
+}
@@ -0,0 +1,50 @@
+// LRU + TTL 缓存模块
+// 进程（isolate）内的有界缓存：超过容量淘汰最久未使用的条目，超过 TTL 的条目视为不存在
+
+export class LruCache<K, V> {
+  private readonly entries = new Map<K, { value: V; expiresAt: number }>();
+
+  /**
+   * @param maxEntries - 最大条目数
+   * @param ttlMs - 条目有效期（毫秒）
+   */
+  constructor(private readonly maxEntries: number, private readonly ttlMs: number) {}
+
+  get size(): number {
+    return this.entries.size;
+  }
+
+  get(key: K): V | undefined {
+    const entry = this.entries.get(key);
+    if (!entry) return undefined;
+    if (entry.expiresAt <= Date.now()) {
+      this.entries.delete(key);
+      return undefined;
+    }
+    // 重新插入，移到最近使用的位置
+    this.entries.delete(key);
+    this.entries.set(key, entry);
+    return entry.value;
+  }
+
+  has(key: K): boolean {
+    return this.get(key) !== undefined;
+  }
+
+  set(key: K, value: V): void {
+    this.entries.delete(key);
+    this.entries.set(key, { value, expiresAt: Date.now() + this.ttlMs });
+    while (this.entries.size > this.maxEntries) {
+      const oldest = this.entries.keys().next().value as K;
+      this.entries.delete(oldest);
+    }
+  }
+
+  delete(key: K): void {
+    this.entries.delete(key);
+  }
+
+  clear(): void {
+    this.entries.clear();
+  }
+}
@@ -0,0 +1,158 @@
+// 字段映射缓存模块
+// isolate 内缓存 feishuBitable_Mapping 的全部映射（含编译好的转换 / 编码函数），
+// 同时按 (app_token, table_id) 与 (db_schema, db_table) 建立索引
+// - TTL 内直接使用缓存，不发起任何查询
+// - TTL 到期后只查询 feishu_mapping_version 的版本号，版本未变则续期，变化时才重新加载全部映射
+// - 加载时调用 feishu_mapping_documents()，一次请求得到按表聚合好的映射文档
+import { supabaseClient } from './supabaseClient.ts';
+import {
+  compileBitableRowConverter,
+  compileBitableFieldsEncoder,
+  type FieldMappingRow,
+  type BitableRowConverter,
+  type BitableFieldsEncoder
+} from './mappingCompiler.ts';
+
+// 缓存有效期：到期后校验一次版本号
+const MAPPING_TTL_MS = 60 * 1000;
+// 一对 飞书表 ↔ 数据库表 的映射
+export interface TableMapping {
+  app_token: string;
+  table_id: string;
+  db_schema: string;
+  db_table: string;
+  fields: FieldMappingRow[];
+  feishu_to_db: Record<string, string>;  // 飞书字段名 → 数据库字段名
+  db_to_feishu: Record<string, string>;  // 数据库字段名 → 飞书字段名
+  convert: BitableRowConverter;   // 飞书记录 → 数据库行
+  encode: BitableFieldsEncoder;   // 数据库行 → 飞书 fields
+}
+
+interface MappingSnapshot {
+  version: number | null;         // 版本表不存在时为 null（每次到期都重新加载）
+  checkedAt: number;
+  byBitable: Map<string, TableMapping>;
+  byTable: Map<string, TableMapping>;
+}
+
+let snapshot: MappingSnapshot | null = null;
+let refreshing: Promise<MappingSnapshot> | null = null;
+
+const bitableKey = (app_token: string, table_id: string) => `${app_token}/${table_id}`;
+const tableKey = (db_schema: string, db_table: string) => `${db_schema}.${db_table}`;
+
+async function fetchVersion(): Promise<number | null> {
+  const { data, error } = await supabaseClient
+    .schema('public')
+    .from('feishu_mapping_version')
+    .select('version')
+    .maybeSingle();
+  if (error) {
+    console.warn('查询映射版本失败，将重新加载映射:', error.message);
+    return null;
+  }
+  return data ? Number(data.version) : null;
+}
+
+// feishu_mapping_documents() 返回的单表文档
+interface MappingDocument {
+  app_token: string;
+  table_id: string;
+  db_schema: string;
+  db_table: string;
+  fields: FieldMappingRow[];
+  feishu_to_db: Record<string, string>;
+  db_to_feishu: Record<string, string>;
+}
+
+async function fetchMappingDocuments(): Promise<{ version: number | null; tables: MappingDocument[] }> {
+  const { data, error } = await supabaseClient.schema('public').rpc('feishu_mapping_documents');
+  if (error) {
+    throw new Error(`查询映射失败: ${error.message}`);
+  }
+  return {
+    version: data?.version === null || data?.version === undefined ? null : Number(data.version),
+    tables: data?.tables ?? []
+  };
+}
+
+// 编译并建立索引：每个文档对应一对 飞书表 ↔ 数据库表
+// 同一飞书表对应多张数据库表（或反之）时，按飞书表（按数据库表）索引保留排序在前的一对，并打印警告
+function buildSnapshot(tables: MappingDocument[], version: number | null): MappingSnapshot {
+  const byBitable = new Map<string, TableMapping>();
+  const byTable = new Map<string, TableMapping>();
+  for (const doc of tables) {
+    const mapping: TableMapping = {
+      ...doc,
+      convert: compileBitableRowConverter(doc.fields),
+      encode: compileBitableFieldsEncoder(doc.fields)
+    };
+    const feishuKey = bitableKey(doc.app_token, doc.table_id);
+    const existing = byBitable.get(feishuKey);
+    if (existing) {
+      console.warn(`飞书表 ${feishuKey} 映射到多张数据库表，按飞书表查询时使用 ${tableKey(existing.db_schema, existing.db_table)}`);
+    } else {
+      byBitable.set(feishuKey, mapping);
+    }
+    if (mapping.db_schema && mapping.db_table) {
+      const dbKey = tableKey(mapping.db_schema, mapping.db_table);
+      if (!byTable.has(dbKey)) byTable.set(dbKey, mapping);
+    }
+  }
+  return { version, checkedAt: Date.now(), byBitable, byTable };
+}
+
+async function refresh(current: MappingSnapshot | null): Promise<MappingSnapshot> {
+  const version = await fetchVersion();
+  if (current && version !== null && version === current.version) {
+    current.checkedAt = Date.now();
+    return current;
+  }
+  // 以文档中的版本号为准：与映射内容在同一快照中读取
+  const documents = await fetchMappingDocuments();
+  const next = buildSnapshot(documents.tables, documents.version);
+  console.log(`映射缓存已加载: version=${documents.version ?? '-'}, 飞书表=${next.byBitable.size}`);
+  return next;
+}
+
+/**
+ * 获取当前有效的映射快照（并发调用共用同一次刷新）
+ * @throws 首次加载失败时抛出；已有快照时刷新失败则继续使用旧快照
+ */
+async function getSnapshot(): Promise<MappingSnapshot> {
+  if (snapshot && Date.now() - snapshot.checkedAt < MAPPING_TTL_MS) {
+    return snapshot;
+  }
+  if (!refreshing) {
+    const current = snapshot;
+    refreshing = refresh(current)
+      .then(next => (snapshot = next))
+      .catch(error => {
+        if (!current) throw error;
+        console.error('刷新映射缓存失败，继续使用旧映射:', error);
+        return current;
+      })
+      .finally(() => { refreshing = null; });
+  }
+  return refreshing;
+}
+
+/**
+ * 按飞书表查询映射
+ * @param app_token 飞书应用token
+ * @param table_id 表格ID
+ * @returns 映射；未配置时返回 undefined
+ */
+export async function getMappingByBitable(app_token: string, table_id: string): Promise<TableMapping | undefined> {
+  return (await getSnapshot()).byBitable.get(bitableKey(app_token, table_id));
+}
+
+/**
+ * 按数据库表查询映射
+ * @param db_schema 数据库 schema
+ * @param db_table 数据库表名
+ * @returns 映射；未配置时返回 undefined
+ */
+export async function getMappingByTable(db_schema: string, db_table: string): Promise<TableMapping | undefined> {
+  return (await getSnapshot()).byTable.get(tableKey(db_schema, db_table));
+}
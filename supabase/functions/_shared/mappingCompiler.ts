@@ -0,0 +1,86 @@
+// 字段映射编译模块
+// 根据 feishuBitable_Mapping 的映射行为每张表生成一次专用的转换函数（两个方向：飞书 → 数据库、数据库 → 飞书），
+// 逐行转换时只做按类型确定的取值与转换，不再逐格探测值的结构；编译结果由 mappingCache.ts 缓存
+import { getFieldTransformer } from './transBitableRecordsToDB.ts';
+import { getFieldEncoder, READONLY_FIELD_TYPES } from './transDBRecordsToBitable.ts';
+
+// feishuBitable_Mapping 中的一行字段映射
+export interface FieldMappingRow {
+  db_field: string;
+  feishu_field_name: string;
+  feishu_field_type?: number | null;
+  readonly?: boolean; // 由 feishu_mapping_documents() 给出；缺省时按 feishu_field_type 判断
+}
+
+// 飞书记录 → 数据库行
+export type BitableRowConverter = (record: { record_id: string; fields?: Record<string, any> }) => Record<string, any>;
+
+/**
+ * 编译飞书记录 → 数据库行的转换函数
+ * - 忽略 db_field 为 id 的映射（id 由数据库生成）
+ * - 飞书记录中不存在的字段置为 null；单个字段转换失败时记录警告并置为 null
+ * @param mappings 同一 (app_token, table_id) 的映射行
+ * @returns 行转换函数，结果包含 record_id 与所有映射的 db_field
+ */
+export function compileBitableRowConverter(mappings: FieldMappingRow[]): BitableRowConverter {
+  const columns = mappings
+    .filter(m => m.db_field && m.db_field !== 'id')
+    .map(m => ({
+      dbField: m.db_field,
+      feishuField: m.feishu_field_name,
+      transform: getFieldTransformer(m.feishu_field_type)
+    }));
+
+  return (record) => {
+    const srcFields = record.fields || {};
+    const row: Record<string, any> = { record_id: record.record_id };
+    for (const { dbField, feishuField, transform } of columns) {
+      const value = feishuField ? srcFields[feishuField] : undefined;
+      if (value === undefined) {
+        row[dbField] = null;
+        continue;
+      }
+      try {
+        row[dbField] = transform(value) ?? null;
+      } catch (error) {
+        console.warn(`转换字段 ${feishuField} 失败:`, error);
+        row[dbField] = null;
+      }
+    }
+    return row;
+  };
+}
+
+// 数据库行 → 飞书 fields
+export type BitableFieldsEncoder = (row: Record<string, any>) => Record<string, any>;
+
+/**
+ * 编译数据库行 → 飞书 fields 的编码函数
+ * - 只读字段类型在编译时过滤
+ * - 行中不存在（undefined）的列不写入；单个字段编码失败时记录警告并跳过该字段
+ * @param mappings 同一 (db_schema, db_table) 的映射行
+ * @returns 编码函数，结果以飞书字段名为键
+ */
+export function compileBitableFieldsEncoder(mappings: FieldMappingRow[]): BitableFieldsEncoder {
+  const columns = mappings
+    .filter(m => m.db_field && m.feishu_field_name && !(m.readonly ?? READONLY_FIELD_TYPES.has(Number(m.feishu_field_type))))
+    .map(m => ({
+      dbField: m.db_field,
+      feishuField: m.feishu_field_name,
+      encode: getFieldEncoder(m.feishu_field_type)
+    }));
+
+  return (row) => {
+    const fields: Record<string, any> = {};
+    for (const { dbField, feishuField, encode } of columns) {
+      const value = row[dbField];
+      if (value === undefined) continue;
+      try {
+        fields[feishuField] = encode(value);
+      } catch (error) {
+        console.warn(`字段转换失败: ${dbField}`, error);
+      }
+    }
+    return fields;
+  };
+}
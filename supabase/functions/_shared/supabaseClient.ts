@@ -1,6 +1,7 @@
 // Supabase 客户端模块
 import { createClient } from 'npm:@supabase/supabase-js@2';
 import { getSupabaseUrl, getSupabaseServiceRoleKey } from './getDenoEnv.ts';
+import { mapWithConcurrency } from './concurrency.ts';
 
 // 初始化 Supabase 客户端（使用 SERVICE_ROLE 密钥）
 export const supabaseClient = createClient(
@@ -8,20 +9,353 @@ export const supabaseClient = createClient(
   getSupabaseServiceRoleKey()
 );
 
+// PostgREST 的过滤条件拼接在 URL 上，in() 列表按编码后的字节数切分，避免请求头过大
+const MAX_FILTER_BYTES = 4000;
+// 单次写入请求体的字节上限，按序列化后的 JSON 大小自适应切分
+const MAX_PAYLOAD_BYTES = 512 * 1024;
+
+// 批量删除时同时进行的请求数上限
+const DELETE_CONCURRENCY = 4;
+
+const textEncoder = new TextEncoder();
+
+/**
+ * 按字节预算将数组切分为多个批次
+ * @param items - 待切分的数组
+ * @param maxBytes - 每批允许的最大字节数（单个元素超出预算时独占一批）
+ * @param measure - 计算单个元素所占字节数
+ * @returns 切分后的批次数组
+ */
+function chunkByBytes<T>(items: T[], maxBytes: number, measure: (item: T) => number): T[][] {
+  const chunks: T[][] = [];
+  let current: T[] = [];
+  let currentBytes = 0;
+
+  for (const item of items) {
+    const size = measure(item);
+    if (current.length > 0 && currentBytes + size > maxBytes) {
+      chunks.push(current);
+      current = [];
+      currentBytes = 0;
+    }
+    current.push(item);
+    currentBytes += size;
+  }
+
+  if (current.length > 0) {
+    chunks.push(current);
+  }
+  return chunks;
+}
+
+// in() 列表中单个值编码后的长度（按最坏情况计入引号与逗号）
+function filterValueBytes(value: unknown): number {
+  return encodeURIComponent(`"${String(value)}",`).length;
+}
+
+// 单行记录序列化后的字节数（含数组分隔符）
+function rowPayloadBytes(row: Record<string, any>): number {
+  return textEncoder.encode(JSON.stringify(row)).length + 1;
+}
+
+/**
+ * 按唯一键批量查询行
+ * - 使用 in() 分批查询，每批按 URL 字节预算切分，N 条记录只需少量请求
+ * @param schema - schema 名
+ * @param tableName - 表名
+ * @param key - 唯一键字段
+ * @param values - 待查询的唯一键值
+ * @param columns - 需要返回的列（逗号分隔，须包含 key）
+ * @returns 查询到的行
+ */
+async function fetchRowsByKeys(
+  schema: string,
+  tableName: string,
+  key: string,
+  values: any[],
+  columns: string
+): Promise<Record<string, any>[]> {
+  const rows: Record<string, any>[] = [];
+  const uniqueValues = Array.from(new Set(values.map(v => String(v))));
+  const chunks = chunkByBytes(uniqueValues, MAX_FILTER_BYTES, filterValueBytes);
+
+  for (const chunk of chunks) {
+    const { data, error } = await supabaseClient
+      .schema(schema)
+      .from(tableName)
+      .select(columns)
+      .in(key, chunk);
+
+    if (error) {
+      // 保留 PostgreSQL / PostgREST 错误码，便于调用方区分（如 42703 列不存在）
+      throw Object.assign(new Error(`批量查询失败 (${key}, ${chunk.length}条): ${error.message}`), { code: error.code });
+    }
+    rows.push(...((data ?? []) as Record<string, any>[]));
+  }
+
+  console.log(`[fetchRowsByKeys] ${schema}.${tableName}: 查询 ${uniqueValues.length} 个键, ${chunks.length} 次请求, 命中 ${rows.length} 行`);
+  return rows;
+}
+
+/**
+ * 批量查询表中已存在的唯一键值
+ * @param schema - schema 名
+ * @param tableName - 表名
+ * @param key - 唯一键字段
+ * @param values - 待查询的唯一键值
+ * @returns 已存在的唯一键值集合（统一转为字符串）
+ */
+export async function resolveExistingKeys(
+  schema: string,
+  tableName: string,
+  key: string,
+  values: any[]
+): Promise<Set<string>> {
+  const rows = await fetchRowsByKeys(schema, tableName, key, values, key);
+  return new Set(rows.map(row => String(row[key])));
+}
+
+// 同步路径维护的行内容哈希列（见 migrations/*_sync_row_hash.sql）
+export const ROW_HASH_COLUMN = 'sync_hash';
+
+// 列不存在的错误码：42703 为 PostgreSQL undefined_column，PGRST204 为 PostgREST 结构缓存中找不到列
+const UNDEFINED_COLUMN_CODES = new Set(['42703', 'PGRST204']);
+// 没有哈希列的目标（视图、在映射之后才创建的表等），isolate 内记住，不再重复查询
+const tablesWithoutHash = new Set<string>();
+
+// 键排序后的 JSON 序列化，保证相同内容得到相同字符串
+function stableStringify(value: any): string {
+  if (value === null || typeof value !== 'object') {
+    return JSON.stringify(value ?? null);
+  }
+  if (Array.isArray(value)) {
+    return `[${value.map(stableStringify).join(',')}]`;
+  }
+  const keys = Object.keys(value).filter(k => value[k] !== undefined).sort();
+  return `{${keys.map(k => `${JSON.stringify(k)}:${stableStringify(value[k])}`).join(',')}}`;
+}
+
+/**
+ * 计算行内容哈希（SHA-256，hex）
+ * - 不包含哈希列本身
+ * @param row - 行数据
+ * @param hashColumn - 哈希列名
+ * @returns 哈希字符串
+ */
+export async function computeRowHash(
+  row: Record<string, any>,
+  hashColumn: string = ROW_HASH_COLUMN
+): Promise<string> {
+  const { [hashColumn]: _ignored, ...content } = row;
+  const digest = await crypto.subtle.digest('SHA-256', textEncoder.encode(stableStringify(content)));
+  return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+}
+
+/**
+ * 过滤内容未变化的行
+ * - 为每行计算哈希并写入 hashColumn，与库中已存哈希一致的行被跳过
+ * - 目标没有 hashColumn 列时不做过滤，原样返回全部行（不带哈希列）
+ * @param table - 表名，支持 schema.table 格式，默认 schema 为 public
+ * @param rows - 待写入的行（每行必须包含 key 字段）
+ * @param key - 唯一键字段
+ * @param hashColumn - 哈希列名，默认 sync_hash
+ * @returns { changed: 需要写入的行（已带哈希）, skipped: 跳过的行数 }
+ */
+export async function filterUnchangedRows(
+  table: string,
+  rows: Record<string, any>[],
+  key: string,
+  hashColumn: string = ROW_HASH_COLUMN
+): Promise<{ changed: Record<string, any>[]; skipped: number }> {
+  if (rows.length === 0) {
+    return { changed: [], skipped: 0 };
+  }
+
+  const [schema, tableName] = table.includes('.') ? table.split('.', 2) : ['public', table];
+  const hashKey = `${schema}.${tableName}.${hashColumn}`;
+  if (tablesWithoutHash.has(hashKey)) {
+    return { changed: rows, skipped: 0 };
+  }
+
+  const hashed = await Promise.all(rows.map(async row => ({
+    ...row,
+    [hashColumn]: await computeRowHash(row, hashColumn)
+  })));
+
+  let stored: Record<string, any>[];
+  try {
+    stored = await fetchRowsByKeys(schema, tableName, key, rows.map(row => row[key]), `${key},${hashColumn}`);
+  } catch (error) {
+    if (!UNDEFINED_COLUMN_CODES.has((error as any)?.code)) throw error;
+    console.warn(`[filterUnchangedRows] ${schema}.${tableName} 没有 ${hashColumn} 列，跳过哈希过滤`);
+    tablesWithoutHash.add(hashKey);
+    return { changed: rows, skipped: 0 };
+  }
+  const storedHashes = new Map(stored.map(row => [String(row[key]), row[hashColumn]]));
+
+  const changed = hashed.filter(row => storedHashes.get(String(row[key])) !== row[hashColumn]);
+  const skipped = hashed.length - changed.length;
+  console.log(`[filterUnchangedRows] ${schema}.${tableName}: 共 ${hashed.length} 行, 跳过未变化 ${skipped} 行`);
+  return { changed, skipped };
+}
+
+export interface BulkUpdateResult {
+  result: "success" | string;  // 成功返回"success"，失败返回错误信息
+  keys: string[];              // 实际被更新的唯一键值
+}
+
+/**
+ * 批量更新记录（调用 public.sync_bulk_update）
+ * - 各行可以携带不同的字段子集，只更新行内出现的字段
+ * - 按请求体字节数分块，每块在数据库中只执行一条 UPDATE
+ * @param table - 表名，支持 schema.table 格式，默认 schema 为 public
+ * @param records - 要更新的记录数组，每条必须包含 key 字段
+ * @param key - 用于匹配记录的唯一键字段
+ * @returns Promise<BulkUpdateResult>
+ */
+export async function bulkUpdateRecords(
+  table: string,
+  records: Record<string, any>[],
+  key: string
+): Promise<BulkUpdateResult> {
+  const keys: string[] = [];
+  try {
+    if (!table || !Array.isArray(records) || !key) {
+      throw new Error("table, records, key 参数均为必填");
+    }
+    if (records.length === 0) {
+      return { result: "success", keys };
+    }
+
+    const [schema, tableName] = table.includes('.') ? table.split('.', 2) : ['public', table];
+
+    // 同一键值出现多次时以最后一条为准
+    const latestByKey = new Map<string, Record<string, any>>();
+    for (const record of records) {
+      if (record[key] == null) {
+        throw new Error(`记录缺少必需的 ${key} 字段或值为 null: ${JSON.stringify(record)}`);
+      }
+      latestByKey.set(String(record[key]), record);
+    }
+
+    const chunks = chunkByBytes(Array.from(latestByKey.values()), MAX_PAYLOAD_BYTES, rowPayloadBytes);
+    for (const chunk of chunks) {
+      const { data, error } = await supabaseClient.rpc('sync_bulk_update', {
+        p_schema: schema,
+        p_table: tableName,
+        p_key: key,
+        p_rows: chunk
+      });
+      if (error) {
+        throw new Error(`批量更新失败 (${chunk.length}条): ${error.message}`);
+      }
+      keys.push(...((data ?? []) as string[]));
+    }
+
+    console.log(`[bulkUpdateRecords] ${schema}.${tableName}: 提交 ${latestByKey.size} 条, ${chunks.length} 次请求, 更新 ${keys.length} 条`);
+    return { result: "success", keys };
+  } catch (err) {
+    const errMsg = err instanceof Error ? err.message : "Unknown error";
+    console.error('[bulkUpdateRecords] 错误:', errMsg);
+    return { result: errMsg, keys };
+  }
+}
+
+export interface PgmqMessageRef {
+  queue_name: string;
+  message_id: number;
+}
+
+export interface ApplyAndAckResult {
+  result: "success" | string;  // 成功返回"success"，失败返回错误信息
+  upserted: number;
+  deleted: number;
+  acked: number;
+}
+
+/**
+ * 在同一事务中写入行并确认队列消息（调用 public.sync_apply_and_ack）
+ * - upserts 按唯一键插入或更新，deletes 按唯一键删除，messages 为来源 PGMQ 消息
+ * - 任一步失败整体回滚，消息保留在队列中等待重试
+ * @param table - 表名，支持 schema.table 格式，默认 schema 为 public
+ * @param changes - { upserts?: 行数组, deletes?: 唯一键值数组 }
+ * @param key - 唯一键字段（upsert 需该字段上有唯一约束）
+ * @param messages - 需要一并删除的队列消息
+ * @returns Promise<ApplyAndAckResult>
+ */
+export async function applyRowsAndAck(
+  table: string,
+  changes: { upserts?: Record<string, any>[]; deletes?: any[] },
+  key: string,
+  messages: PgmqMessageRef[] = []
+): Promise<ApplyAndAckResult> {
+  try {
+    if (!table || !changes || !key) {
+      throw new Error("table, changes, key 参数均为必填");
+    }
+
+    const [schema, tableName] = table.includes('.') ? table.split('.', 2) : ['public', table];
+
+    // 同一唯一键在一条 INSERT ... ON CONFLICT 中只能出现一次，以最后一条为准
+    const upsertsByKey = new Map<string, Record<string, any>>();
+    for (const row of changes.upserts ?? []) {
+      if (row[key] == null) {
+        throw new Error(`记录缺少必需的 ${key} 字段或值为 null: ${JSON.stringify(row)}`);
+      }
+      upsertsByKey.set(String(row[key]), row);
+    }
+    const deletes = Array.from(new Set((changes.deletes ?? []).filter(v => v != null).map(v => String(v))));
+
+    const { data, error } = await supabaseClient.rpc('sync_apply_and_ack', {
+      p_schema: schema,
+      p_table: tableName,
+      p_key: key,
+      p_upserts: Array.from(upsertsByKey.values()),
+      p_deletes: deletes,
+      p_messages: messages.filter(m => m.queue_name && m.message_id)
+    });
+    if (error) {
+      throw new Error(`写入并确认消息失败: ${error.message}`);
+    }
+
+    const { upserted = 0, deleted = 0, acked = 0 } = (data ?? {}) as Record<string, number>;
+    console.log(`[applyRowsAndAck] ${schema}.${tableName}: upserted=${upserted}, deleted=${deleted}, acked=${acked}`);
+    return { result: "success", upserted, deleted, acked };
+  } catch (err) {
+    const errMsg = err instanceof Error ? err.message : "Unknown error";
+    console.error('[applyRowsAndAck] 错误:', errMsg);
+    return { result: errMsg, upserted: 0, deleted: 0, acked: 0 };
+  }
+}
+
+/**
+ * upsertRecords 的写入模式
+ * - split: 先批量查询已存在的键，再批量 INSERT / bulkUpdateRecords（不依赖唯一约束）
+ * - upsert: 直接使用 PostgREST on_conflict 整批写入，要求 onConflict 字段上有唯一约束
+ */
+export type UpsertMode = 'split' | 'upsert';
+
+export interface UpsertRecordsOptions {
+  mode?: UpsertMode;
+}
+
 /**
  * 插入或更新记录到指定表
  * @param table - 表名，支持 schema.table 格式，默认 schema 为 public
  * @param records - 要插入或更新的记录，可以是单个对象或对象数组
  * @param onConflict - 必填，用于判断记录是否存在的唯一键字段
+ * @param options - 可选，mode 默认为 "split"
  * @returns Promise<"success" | string> - 成功返回"success"，失败返回错误信息
  */
 export async function upsertRecords(
   table: string,
   records: Record<string, any> | Record<string, any>[],
-  onConflict: string
+  onConflict: string,
+  options: UpsertRecordsOptions = {}
 ): Promise<"success" | string> {
+  const mode = options.mode ?? 'split';
   try {
-    console.log('[upsertRecords] 参数:', { table, records, onConflict });
+    console.log('[upsertRecords] 参数:', { table, records, onConflict, mode });
 
     // 参数验证
     if (!table || !records || !onConflict) {
@@ -44,40 +378,40 @@ export async function upsertRecords(
       }
     }
 
-    // 逐条查询现有记录，避免批量查询导致请求头过大
-    const existingSet = new Set<any>();
+    // upsert 模式：按请求体字节数分块，每块一次 upsert 请求
+    if (mode === 'upsert') {
+      const chunks = chunkByBytes(recordsArray, MAX_PAYLOAD_BYTES, rowPayloadBytes);
+      for (const chunk of chunks) {
+        const { error: upsertError } = await supabaseClient
+          .schema(schema)
+          .from(tableName)
+          .upsert(chunk, { onConflict });
+        if (upsertError) {
+          throw new Error(`upsert 失败 (${chunk.length}条): ${upsertError.message}`);
+        }
+      }
+      console.log(`[upsertRecords] upsert 完成: ${recordsArray.length} 条, ${chunks.length} 次请求`);
+      return "success";
+    }
+
+    // 批量查询现有记录（in() 按 URL 字节预算分批），区分插入与更新
+    const existingSet = await resolveExistingKeys(
+      schema,
+      tableName,
+      onConflict,
+      recordsArray.map(record => record[onConflict])
+    );
     const toInsert: Record<string, any>[] = [];
     const toUpdate: Record<string, any>[] = [];
 
     for (const record of recordsArray) {
-      const conflictValue = record[onConflict];
-      console.log(`[upsertRecords] 查询记录: ${onConflict}=${conflictValue}`);
-      
-      const { data: existingRecord, error: selectError } = await supabaseClient
-        .schema(schema)
-        .from(tableName)
-        .select(onConflict)
-        .eq(onConflict, conflictValue)
-        .single();
-
-      if (selectError) {
-        // 如果是记录不存在的错误，则为新记录
-        if (selectError.code === 'PGRST116') {
-          toInsert.push(record);
-          console.log(`[upsertRecords] 新记录待插入: ${onConflict}=${conflictValue}`);
-        } else {
-          throw new Error(`查询失败 (${onConflict}=${conflictValue}): ${selectError.message}`);
-        }
-      } else {
-        // 记录存在，需要更新
-        existingSet.add(conflictValue);
+      if (existingSet.has(String(record[onConflict]))) {
         toUpdate.push(record);
-        console.log(`[upsertRecords] 现有记录待更新: ${onConflict}=${conflictValue}`);
+      } else {
+        toInsert.push(record);
       }
     }
 
-    console.log(`[upsertRecords] 现有记录:`, Array.from(existingSet));
-
     console.log(`[upsertRecords] 待插入: ${toInsert.length}, 待更新: ${toUpdate.length}`);
 
     // 执行 INSERT
@@ -91,15 +425,11 @@ export async function upsertRecords(
       }
     }
 
-    // 执行 UPDATE（逐条）
-    for (const record of toUpdate) {
-      const { error: updateError } = await supabaseClient
-        .schema(schema)
-        .from(tableName)
-        .update(record)
-        .eq(onConflict, record[onConflict]);
-      if (updateError) {
-        throw new Error(`更新失败 (${onConflict}=${record[onConflict]}): ${updateError.message}`);
+    // 执行 UPDATE（批量，一次 RPC 更新一块）
+    if (toUpdate.length > 0) {
+      const { result: updateResult } = await bulkUpdateRecords(table, toUpdate, onConflict);
+      if (updateResult !== "success") {
+        throw new Error(`更新失败: ${updateResult}`);
       }
     }
 
@@ -149,6 +479,54 @@ export async function deletePgmqMessage(
   }
 }
 
+/**
+ * 批量删除PGMQ队列中的消息（不会抛出异常）
+ * - 一个队列只需一次 RPC（pgmq_public.delete_batch）
+ * - 返回每个消息ID的结果："success"、"not found" 或错误信息
+ * @param queueName - 队列名称
+ * @param msgIds - 消息ID数组
+ * @returns Promise<Record<number, "success" | string>>
+ */
+export async function deletePgmqMessages(
+  queueName: string,
+  msgIds: number[]
+): Promise<Record<number, "success" | string>> {
+  const results: Record<number, "success" | string> = {};
+  const ids = Array.from(new Set((msgIds ?? []).filter(Boolean)));
+
+  // 参数验证（不抛出异常）
+  if (!queueName || ids.length === 0) {
+    const msg = "Queue name and message IDs are required";
+    console.error(msg);
+    for (const id of ids) results[id] = msg;
+    return results;
+  }
+
+  try {
+    const { data, error } = await supabaseClient
+      .schema('pgmq_public')
+      .rpc('delete_batch', { queue_name: queueName, message_ids: ids });
+
+    if (error) {
+      console.error(`[PGMQ delete_batch] 失败 queue=${queueName}, ids=${ids.length}:`, error.message);
+      for (const id of ids) results[id] = error.message;
+      return results;
+    }
+
+    const deleted = new Set(((data ?? []) as Array<number | string>).map(Number));
+    for (const id of ids) {
+      results[id] = deleted.has(Number(id)) ? "success" : "not found";
+    }
+    console.log(`[PGMQ delete_batch] 完成 queue=${queueName}, 请求=${ids.length}, 删除=${deleted.size}`);
+    return results;
+  } catch (err) {
+    const msg = err instanceof Error ? err.message : "Unknown error occurred";
+    console.error(`[PGMQ delete_batch] 异常 queue=${queueName}, ids=${ids.length}:`, msg);
+    for (const id of ids) results[id] = msg;
+    return results;
+  }
+}
+
 /**
  * 删除指定表中的记录
  * @param table - 表名，支持 schema.table 格式，默认 schema 为 public
@@ -188,24 +566,28 @@ export async function deleteRecords(
       }
     }
 
-    // 逐条删除记录，避免批量删除导致请求头过大
-    let deletedCount = 0;
-    for (const record of recordsArray) {
-      const conflictValue = record[onConflict];
-      console.log(`[deleteRecords] 删除记录: ${onConflict}=${conflictValue}`);
-      
-      const { error } = await supabaseClient
+    // 按 in() 列表编码后的 URL 字节数分块，有限并发批量删除
+    const values = Array.from(new Set(recordsArray.map(record => String(record[onConflict]))));
+    const chunks = chunkByBytes(values, MAX_FILTER_BYTES, filterValueBytes);
+    const chunkResults = await mapWithConcurrency(chunks, DELETE_CONCURRENCY, async (chunk, index) => {
+      const { error, count } = await supabaseClient
         .schema(schema)
         .from(tableName)
-        .delete()
-        .eq(onConflict, conflictValue);
+        .delete({ count: 'exact' })
+        .in(onConflict, chunk);
 
       if (error) {
-        throw new Error(`删除失败 (${onConflict}=${conflictValue}): ${error.message}`);
+        console.error(`[deleteRecords] 第${index + 1}/${chunks.length}块删除失败 (${chunk.length}条): ${error.message}`);
+        return { error: error.message, count: 0 };
       }
-      
-      deletedCount++;
-      console.log(`[deleteRecords] 成功删除记录: ${onConflict}=${conflictValue}`);
+      console.log(`[deleteRecords] 第${index + 1}/${chunks.length}块: 请求 ${chunk.length} 条, 实际删除 ${count ?? 0} 条`);
+      return { error: null, count: count ?? 0 };
+    });
+
+    const deletedCount = chunkResults.reduce((sum, r) => sum + r.count, 0);
+    const failed = chunkResults.filter(r => r.error);
+    if (failed.length > 0) {
+      throw new Error(`删除失败 (${failed.length}/${chunks.length}块, 已删除 ${deletedCount} 条): ${failed[0].error}`);
     }
 
     console.log(`[deleteRecords] 总共删除 ${deletedCount} 条记录`);
@@ -191,4 +191,72 @@ export function transformFieldValueByType(fieldValue: any, type: number): any {
       // 未知类型保持原样
       return fieldValue;
   }
-}
\ No newline at end of file
+}
+
+// 多行文本：[{type:"text",text:"xxx"}, ...] → 拼接所有text
+function joinTextSegments(fieldValue: any): any {
+  if (!Array.isArray(fieldValue)) return fieldValue;
+  let text = '';
+  for (const item of fieldValue) {
+    if (item && typeof item === 'object' && 'text' in item) text += item.text || '';
+  }
+  return text;
+}
+
+// 日期（毫秒时间戳）→ ISO 8601，PostgreSQL可以直接识别
+function timestampToISO(fieldValue: any): any {
+  return typeof fieldValue === 'number' && Number.isFinite(fieldValue)
+    ? new Date(fieldValue).toISOString()
+    : fieldValue;
+}
+
+// 公式 / 查找引用：{type, value} → 按结果的字段类型转换 value
+function unwrapTypedValue(fieldValue: any): any {
+  if (fieldValue && typeof fieldValue === 'object' && !Array.isArray(fieldValue) && 'value' in fieldValue) {
+    const inner = FIELD_TRANSFORMERS[fieldValue.type];
+    return inner ? inner(fieldValue.value) : transformFieldValue(fieldValue.value);
+  }
+  return fieldValue;
+}
+
+function passThrough(fieldValue: any): any {
+  return fieldValue;
+}
+
+// 飞书字段类型 → 专用转换函数（不做结构探测）
+const FIELD_TRANSFORMERS: Record<number, (fieldValue: any) => any> = {
+  1: joinTextSegments,   // 文本
+  2: passThrough,        // 数字
+  3: passThrough,        // 单选
+  4: passThrough,        // 多选
+  5: timestampToISO,     // 日期
+  7: passThrough,        // 复选框
+  11: passThrough,       // 人员
+  13: passThrough,       // 电话号码
+  15: passThrough,       // 超链接
+  17: passThrough,       // 附件
+  18: passThrough,       // 单向关联
+  19: unwrapTypedValue,  // 查找引用
+  20: unwrapTypedValue,  // 公式
+  21: passThrough,       // 双向关联
+  22: passThrough,       // 地理位置
+  23: passThrough,       // 群组
+  1001: timestampToISO,  // 创建时间
+  1002: timestampToISO,  // 最后更新时间
+  1003: passThrough,     // 创建人
+  1004: passThrough,     // 修改人
+  1005: passThrough,     // 自动编号
+};
+
+/**
+ * 获取指定飞书字段类型的转换函数
+ * - 已知类型返回专用转换函数，调用时不再探测值的结构
+ * - 类型为空或未知时回退到 transformFieldValue（按结构自动识别）
+ * @param type 飞书字段类型（feishuBitable_Mapping.feishu_field_type）
+ * @returns 转换函数（空值原样返回）
+ */
+export function getFieldTransformer(type: number | null | undefined): (fieldValue: any) => any {
+  const transform = type === null || type === undefined ? undefined : FIELD_TRANSFORMERS[type];
+  if (!transform) return transformFieldValue;
+  return (fieldValue: any) => (fieldValue === null || fieldValue === undefined ? fieldValue : transform(fieldValue));
+}
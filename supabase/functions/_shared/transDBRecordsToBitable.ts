@@ -0,0 +1,135 @@
+/**
+ * 数据库字段值 → 飞书多维表格写入格式
+ * 与 transBitableRecordsToDB.ts 方向相反：按 feishu_field_type 把数据库中的值编码为飞书接口要求的格式
+ *
+ * 编码规则：
+ * - 文本 / 单选 / 电话号码：字符串
+ * - 数字：number；日期：毫秒时间戳
+ * - 多选：字符串数组；复选框：boolean
+ * - 人员 / 群组：[{ id }]；附件：[{ file_token }]
+ * - 超链接：{ link, text }；单向 / 双向关联：record_id 数组
+ * - 地理位置："经度,纬度" 字符串
+ * - 只读字段（查找引用、公式、创建时间等）由调用方在编译映射时过滤
+ *
+ * 异常处理：
+ * - 无法编码的值抛出异常，调用方记录警告并跳过该字段
+ */
+
+// 只读字段类型：查找引用、公式、创建时间、最后更新时间、创建人、修改人、自动编号
+export const READONLY_FIELD_TYPES = new Set([19, 20, 1001, 1002, 1003, 1004, 1005]);
+
+function toText(value: any): string {
+  return typeof value === 'object' ? JSON.stringify(value) : String(value);
+}
+
+// 非数字输入抛出异常（跳过该字段），避免写入 null 清空飞书单元格
+function toNumber(value: any): number {
+  const n = typeof value === 'number' ? value : typeof value === 'string' && value.trim() ? Number(value) : NaN;
+  if (!Number.isFinite(n)) throw new Error(`无法解析的数字: ${value}`);
+  return n;
+}
+
+// 数据库中的 timestamptz 为 ISO 字符串，数字视为毫秒时间戳
+function toTimestamp(value: any): number {
+  if (typeof value === 'number') return value;
+  const ms = value instanceof Date ? value.getTime() : Date.parse(value);
+  if (Number.isNaN(ms)) throw new Error(`无法解析的日期: ${value}`);
+  return ms;
+}
+
+function toBoolean(value: any): boolean {
+  if (typeof value === 'string') return ['true', 't', '1', 'yes', 'y'].includes(value.toLowerCase());
+  return Boolean(value);
+}
+
+// 数组 / JSON 数组字符串 / 逗号分隔字符串 → 数组
+function toList(value: any): any[] {
+  if (Array.isArray(value)) return value;
+  if (typeof value === 'string') {
+    const trimmed = value.trim();
+    if (trimmed.startsWith('[')) return JSON.parse(trimmed);
+    return trimmed ? trimmed.split(',').map(s => s.trim()).filter(Boolean) : [];
+  }
+  return [value];
+}
+
+function toStringList(value: any): string[] {
+  return toList(value).map(toText);
+}
+
+// 人员 / 群组：[{ id }]
+function toIdObjects(value: any): Array<{ id: string }> {
+  return toList(value).map(v => (v && typeof v === 'object' ? { id: String(v.id) } : { id: String(v) }));
+}
+
+// 附件：[{ file_token }]
+function toAttachments(value: any): Array<{ file_token: string }> {
+  return toList(value).map(v => (v && typeof v === 'object' ? { file_token: String(v.file_token) } : { file_token: String(v) }));
+}
+
+// 关联：record_id 数组
+// 飞书 → 数据库方向原样保存为 { link_record_ids: [...] }，也接受 record_id 字符串数组 / [{ record_id }]
+// 无法识别的值抛出异常（跳过该字段），避免把 "undefined" 之类的 record_id 写入飞书导致整批被拒
+function toRecordIds(value: any): string[] {
+  let parsed = value;
+  if (typeof parsed === 'string' && parsed.trim().startsWith('{')) parsed = JSON.parse(parsed);
+  if (parsed && typeof parsed === 'object' && !Array.isArray(parsed)) {
+    if (!Array.isArray(parsed.link_record_ids)) throw new Error(`无法识别的关联值: ${JSON.stringify(value)}`);
+    parsed = parsed.link_record_ids;
+  }
+  return toList(parsed).map(v => {
+    const id = v && typeof v === 'object' ? v.record_id ?? v.id : v;
+    if (typeof id !== 'string' || !id) throw new Error(`无法识别的关联值: ${JSON.stringify(value)}`);
+    return id;
+  });
+}
+
+function toLink(value: any): { link: string; text: string } {
+  if (value && typeof value === 'object') {
+    const link = String(value.link ?? value.url ?? '');
+    return { link, text: String(value.text ?? link) };
+  }
+  return { link: String(value), text: String(value) };
+}
+
+function toLocation(value: any): string {
+  if (value && typeof value === 'object') {
+    if (value.location) return String(value.location);
+    if (value.longitude !== undefined && value.latitude !== undefined) return `${value.longitude},${value.latitude}`;
+  }
+  return String(value);
+}
+
+function passThrough(value: any): any {
+  return value instanceof Date ? value.getTime() : value;
+}
+
+// 飞书字段类型 → 编码函数
+const FIELD_ENCODERS: Record<number, (value: any) => any> = {
+  1: toText,          // 文本
+  2: toNumber,        // 数字
+  3: toText,          // 单选
+  4: toStringList,    // 多选
+  5: toTimestamp,     // 日期
+  7: toBoolean,       // 复选框
+  11: toIdObjects,    // 人员
+  13: toText,         // 电话号码
+  15: toLink,         // 超链接
+  17: toAttachments,  // 附件
+  18: toRecordIds,    // 单向关联
+  21: toRecordIds,    // 双向关联
+  22: toLocation,     // 地理位置
+  23: toIdObjects,    // 群组
+};
+
+/**
+ * 获取指定飞书字段类型的编码函数
+ * - 空值（null）原样返回，用于清空飞书字段
+ * - 类型为空或未知时原样传递（Date 转为毫秒时间戳）
+ * @param type 飞书字段类型（feishuBitable_Mapping.feishu_field_type）
+ * @returns 编码函数
+ */
+export function getFieldEncoder(type: number | null | undefined): (value: any) => any {
+  const encode = (type === null || type === undefined ? undefined : FIELD_ENCODERS[type]) ?? passThrough;
+  return (value: any) => (value === null ? null : encode(value));
+}
@@ -0,0 +1,154 @@
+// webhook 微批模块
+// 飞书批量编辑时每秒会推送大量事件，每个事件只带少量 record_id。
+// 在一个短窗口内按 (file_token, table_id) 合并 record_id，窗口结束或达到记录数上限时
+// 每张表发送去重后的 upsertDBFromBitable 队列消息（超过 500 条时拆分，一次 send_batch 发出），下游可以用满 100 条/批的 batchGet
+import { supabaseClient } from './supabaseClient.ts';
+import { getWebhookBatchWindowMs, getWebhookBatchMaxRecords } from './getDenoEnv.ts';
+import { releaseWebhookEvent } from './webhookEvents.ts';
+import { runInBackground } from './concurrency.ts';
+
+export const UPSERT_QUEUE_NAME = 'invoke_edge_function_jobs';
+// 单条队列消息的记录数：飞书 batchGet 上限（100）的整数倍，保证下游单次调用在超时内完成
+const RECORDS_PER_MESSAGE = 500;
+
+export interface UpsertRecordRef {
+  record_id: string;
+  update_time?: number; // 飞书事件中的修改时间（秒）
+}
+
+// 批次中的一个来源事件
+interface PendingEvent {
+  eventId?: string;
+  records: UpsertRecordRef[];
+  resolve: (sent: boolean) => void;
+}
+
+interface PendingBatch {
+  app_token: string;
+  table_id: string;
+  records: Map<string, UpsertRecordRef>;
+  events: PendingEvent[];
+  timer?: ReturnType<typeof setTimeout>;
+  flushed: Promise<void>;
+  resolveFlushed: () => void;
+}
+
+const pendingBatches = new Map<string, PendingBatch>();
+
+function toMessages(app_token: string, table_id: string, records: UpsertRecordRef[]) {
+  const messages = [];
+  for (let i = 0; i < records.length; i += RECORDS_PER_MESSAGE) {
+    messages.push({
+      function_name: 'upsertDBFromBitable',
+      app_token,
+      table_id,
+      records: records.slice(i, i + RECORDS_PER_MESSAGE)
+    });
+  }
+  return messages;
+}
+
+/**
+ * 逐事件发送（批量发送失败时的回退）
+ * - 仍失败的事件释放 event_id：ack-first 模式下 worker 保留 webhook_inbox 消息稍后重试；
+ *   同步模式下 webhook 已返回 200，飞书不会重新推送，只能记录错误
+ */
+async function sendPerEvent(batch: PendingBatch): Promise<void> {
+  await Promise.all(batch.events.map(async (event) => {
+    let sent = false;
+    try {
+      for (const message of toMessages(batch.app_token, batch.table_id, event.records)) {
+        const { error } = await supabaseClient.schema('pgmq_public').rpc('send', {
+          queue_name: UPSERT_QUEUE_NAME,
+          message,
+          sleep_seconds: 0
+        });
+        if (error) throw error;
+      }
+      sent = true;
+    } catch (error) {
+      console.error(`逐事件发送 upsert 消息失败: event_id=${event.eventId ?? '-'}`, error);
+      if (event.eventId) await releaseWebhookEvent(event.eventId);
+    } finally {
+      event.resolve(sent);
+    }
+  }));
+}
+
+/**
+ * 发送一批 upsert 消息（不抛出异常）
+ * - 按 RECORDS_PER_MESSAGE 拆分为多条消息，通过一次 send_batch 调用发送
+ * - send_batch 失败时回退为逐事件 send，各事件分别得到自己的发送结果
+ */
+async function flushBatch(key: string, batch: PendingBatch): Promise<void> {
+  if (pendingBatches.get(key) !== batch) return;
+  pendingBatches.delete(key);
+  if (batch.timer !== undefined) clearTimeout(batch.timer);
+
+  const records = Array.from(batch.records.values());
+  // 记录过多时拆成多条消息，由多个下游调用并行处理
+  const messages = toMessages(batch.app_token, batch.table_id, records);
+  try {
+    console.log(`发送 upsert 消息到队列: app_token=${batch.app_token}, table_id=${batch.table_id}, 记录数=${records.length}, 消息数=${messages.length}, 事件数=${batch.events.length}`);
+    const { error } = await supabaseClient.schema('pgmq_public').rpc('send_batch', {
+      queue_name: UPSERT_QUEUE_NAME,
+      messages,
+      sleep_seconds: 0
+    });
+    if (error) throw error;
+    for (const event of batch.events) event.resolve(true);
+  } catch (error) {
+    console.error('批量发送 upsert 消息失败，改为逐事件发送:', error);
+    await sendPerEvent(batch);
+  } finally {
+    batch.resolveFlushed();
+  }
+}
+
+/**
+ * 加入待发送的 upsert 记录
+ * - 同一 (app_token, table_id) 在窗口内的记录合并为一条消息，record_id 去重并保留最新的 update_time
+ * - 窗口为 0 或记录数达到上限时立即发送
+ * @param app_token 飞书多维表格 file_token
+ * @param table_id 表格ID
+ * @param records 需要同步的记录
+ * @param eventId 来源事件的 event_id（可选）
+ * @returns 本事件的记录发送完成时 resolve，值为是否发送成功
+ */
+export function enqueueUpsertRecords(
+  app_token: string,
+  table_id: string,
+  records: UpsertRecordRef[],
+  eventId?: string
+): Promise<boolean> {
+  const key = `${app_token}:${table_id}`;
+  const windowMs = getWebhookBatchWindowMs();
+  let batch = pendingBatches.get(key);
+  if (!batch) {
+    let resolveFlushed!: () => void;
+    const flushed = new Promise<void>(r => { resolveFlushed = r; });
+    const created: PendingBatch = { app_token, table_id, records: new Map(), events: [], flushed, resolveFlushed };
+    pendingBatches.set(key, created);
+    // 让 isolate 在响应返回后继续运行到批次发送完成
+    runInBackground(flushed);
+    if (windowMs > 0) {
+      created.timer = setTimeout(() => void flushBatch(key, created), windowMs);
+    }
+    batch = created;
+  }
+
+  for (const record of records) {
+    const existing = batch.records.get(record.record_id);
+    if (!existing || (record.update_time ?? 0) > (existing.update_time ?? 0)) {
+      batch.records.set(record.record_id, record);
+    }
+  }
+  let resolveSent!: (sent: boolean) => void;
+  const sent = new Promise<boolean>(r => { resolveSent = r; });
+  batch.events.push({ eventId, records, resolve: resolveSent });
+
+  if (windowMs === 0 || batch.records.size >= getWebhookBatchMaxRecords()) {
+    void flushBatch(key, batch);
+  }
+  return sent;
+}
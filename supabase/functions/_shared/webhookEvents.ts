@@ -0,0 +1,51 @@
+// webhook 事件去重模块
+// 飞书在 ack 超时时会重复投递同一事件（event_id 相同）：
+// 先查 isolate 内的 LRU，再以 event_id 为唯一键写入 webhook_events 表，写入冲突即为重复事件
+import { supabaseClient } from './supabaseClient.ts';
+import { LruCache } from './lruCache.ts';
+
+// 与 webhook_events 的保留期一致
+const SEEN_EVENTS_TTL_MS = 24 * 60 * 60 * 1000;
+const SEEN_EVENTS_MAX_ENTRIES = 10_000;
+
+const seenEvents = new LruCache<string, true>(SEEN_EVENTS_MAX_ENTRIES, SEEN_EVENTS_TTL_MS);
+
+/**
+ * 认领一个 webhook 事件
+ * - 首次出现返回 true，重复投递返回 false
+ * - 数据库写入失败时放行（返回 true），宁可重复处理也不丢事件
+ * @param event_id 飞书事件头中的 event_id
+ * @param event_type 事件类型（仅用于记录）
+ * @returns 是否应当处理该事件
+ */
+export async function claimWebhookEvent(event_id: string, event_type?: string): Promise<boolean> {
+  if (seenEvents.has(event_id)) return false;
+  seenEvents.set(event_id, true);
+
+  const { data, error } = await supabaseClient
+    .schema('public')
+    .from('webhook_events')
+    .upsert({ event_id, event_type: event_type ?? null }, { onConflict: 'event_id', ignoreDuplicates: true })
+    .select('event_id');
+  if (error) {
+    console.error('写入 webhook_events 失败，按新事件处理:', error.message);
+    return true;
+  }
+  return (data?.length ?? 0) > 0;
+}
+
+/**
+ * 释放已认领的事件（处理失败时调用），让飞书的重试投递可以再次被处理
+ * @param event_id 飞书事件头中的 event_id
+ */
+export async function releaseWebhookEvent(event_id: string): Promise<void> {
+  seenEvents.delete(event_id);
+  const { error } = await supabaseClient
+    .schema('public')
+    .from('webhook_events')
+    .delete()
+    .eq('event_id', event_id);
+  if (error) {
+    console.error('释放 webhook 事件失败:', error.message);
+  }
+}
@@ -25,17 +25,17 @@
  *    - 提高API调用效率，减少重复请求
  *
  * 3. 映射配置查询
- *    - 查询feishuBitable_Mapping表获取映射配置
+ *    - 从映射缓存（_shared/mappingCache.ts）获取映射配置，warm isolate 内不查询数据库
  *    - 根据app_token和table_id获取对应的db_schema和db_table
  *    - 确保删除操作针对正确的数据库表
  *
  * 4. 数据库删除操作
- *    - 使用deleteRecords批量删除数据库记录
+ *    - 使用applyRowsAndAck批量删除数据库记录
  *    - 以record_id作为删除条件
- *    - 支持批量删除提高效率
+ *    - 删除记录与删除队列消息在同一事务中完成
  *
  * 5. 消息清理
- *    - 成功处理的消息从队列中删除
+ *    - 成功处理的消息在删除记录的事务中一并删除
  *    - 失败的消息保留在队列中等待重试
  *
  * 【输入格式】
@@ -88,7 +88,9 @@
  * }
  */
 
-import { deleteRecords, supabaseClient, deletePgmqMessage } from '../_shared/supabaseClient.ts';
+import { applyRowsAndAck, deletePgmqMessages } from '../_shared/supabaseClient.ts';
+import { groupByAppTokenAndTableId } from '../_shared/bitableGroups.ts';
+import { getMappingByBitable } from '../_shared/mappingCache.ts';
 
 // 类型定义
 export interface InputRecordItem {
@@ -210,23 +212,18 @@ Deno.serve(async (req) => {
 
         if (rows.length > 0) {
           console.log(`5.${i + 1}.c 开始删除数据库记录: ${db_schema}.${db_table}`);
-          const deleteResult = await deleteRecords(
+          // 删除记录与删除本组队列消息在同一事务中完成，失败时消息保留等待重试
+          const { result: deleteResult } = await applyRowsAndAck(
             `${db_schema}.${db_table}`,
-            rows,
-            'record_id'
+            { deletes: recordIds },
+            'record_id',
+            (group.msg_queue_info ?? []).map(m => ({ queue_name: m.queue_name, message_id: m.msg_id }))
           );
           console.log(`5.${i + 1}.c 数据库删除结果:`, JSON.stringify(deleteResult, null, 2));
 
           // 设置处理结果状态
           group.process_result = (deleteResult === 'success');
 
-          // 按组即时删除队列消息（仅成功时）— deletePgmqMessage 内部已打印并不抛异常
-          if (group.process_result === true && group.msg_queue_info && group.msg_queue_info.length > 0) {
-            for (const msgInfo of group.msg_queue_info) {
-              await deletePgmqMessage(msgInfo.queue_name, msgInfo.msg_id);
-            }
-          }
-
           results.push({
             group_index: i + 1,
             app_token: group.app_token,
@@ -241,12 +238,8 @@ Deno.serve(async (req) => {
           // 没有数据需要删除也算成功
           group.process_result = true;
 
-          // 按组即时删除队列消息（成功视为可清理）— deletePgmqMessage 内部已打印并不抛异常
-          if (group.msg_queue_info && group.msg_queue_info.length > 0) {
-            for (const msgInfo of group.msg_queue_info) {
-              await deletePgmqMessage(msgInfo.queue_name, msgInfo.msg_id);
-            }
-          }
+          // 按组即时删除队列消息（成功视为可清理）— deleteGroupMessages 内部已打印并不抛异常
+          await deleteGroupMessages(group);
           
           results.push({
             group_index: i + 1,
@@ -291,46 +284,20 @@ Deno.serve(async (req) => {
 });
 
 /**
- * 按 app_token 和 table_id 分组合并数据
+ * 删除分组关联的队列消息（每个队列一次批量删除，不抛异常）
  */
-function groupByAppTokenAndTableId(items: InputGroupItem[]): InputGroupItem[] {
-  const groupMap = new Map<string, InputGroupItem>();
-
-  for (const item of items) {
-    const key = `${item.app_token}:${item.table_id}`;
-    
-    if (groupMap.has(key)) {
-      const existingGroup = groupMap.get(key)!;
-      
-      // 合并records数组，并在这里进行去重
-      const existingRecordIds = new Set(existingGroup.records.map(r => r.record_id));
-      for (const record of item.records) {
-        if (!existingRecordIds.has(record.record_id)) {
-          existingGroup.records.push(record);
-          existingRecordIds.add(record.record_id);
-        }
-      }
-      
-      // 合并msg_queue_info
-      if (item.msg_queue_info) {
-        if (!existingGroup.msg_queue_info) {
-          existingGroup.msg_queue_info = [];
-        }
-        existingGroup.msg_queue_info.push(...item.msg_queue_info);
-      }
-    } else {
-      // 创建新的分组，初始化process_result为false
-      const newGroup: InputGroupItem = {
-        ...item,
-        process_result: false,
-        // 对当前item的records进行去重
-        records: Array.from(new Set(item.records.map(r => r.record_id))).map(id => ({ record_id: id }))
-      };
-      groupMap.set(key, newGroup);
-    }
+async function deleteGroupMessages(group: InputGroupItem): Promise<void> {
+  if (!group.msg_queue_info || group.msg_queue_info.length === 0) return;
+
+  const idsByQueue = new Map<string, number[]>();
+  for (const msgInfo of group.msg_queue_info) {
+    if (!idsByQueue.has(msgInfo.queue_name)) idsByQueue.set(msgInfo.queue_name, []);
+    idsByQueue.get(msgInfo.queue_name)!.push(msgInfo.msg_id);
   }
 
-  return Array.from(groupMap.values());
+  for (const [queueName, msgIds] of idsByQueue) {
+    await deletePgmqMessages(queueName, msgIds);
+  }
 }
 
 /**
@@ -344,22 +311,12 @@ async function getSchemaAndTable(
     throw new Error('getSchemaAndTable: app_token 和 table_id 不能为空');
   }
 
-  const { data, error } = await supabaseClient
-    .schema('public')
-    .from('feishuBitable_Mapping')
-    .select('db_schema, db_table')
-    .eq('feishu_app_token', app_token)
-    .eq('feishu_table_id', table_id);
-
-  if (error) {
-    throw new Error(`查询映射失败: ${error.message}`);
-  }
-  if (!data || data.length === 0) {
+  const mapping = await getMappingByBitable(app_token, table_id);
+  if (!mapping) {
     throw new Error(`未找到映射: app_token=${app_token}, table_id=${table_id}`);
   }
 
-  const first = data[0] as { db_schema: string; db_table: string };
-  const { db_schema, db_table } = first;
+  const { db_schema, db_table } = mapping;
   
   if (!db_schema || !db_table) {
     throw new Error('映射配置缺少 db_schema 或 db_table');
@@ -0,0 +1,103 @@
+// Supabase Edge Function: feishu-webhook-worker
+// Purpose: Consume the "webhook_inbox" queue written by feishu-webhook in ack-first mode
+// (FEISHU_WEBHOOK_ACK_FIRST=true): decrypt the raw Feishu events in bulk and route them
+// through _shared/feishuEventRouter.ts (dedup, upsert micro-batch, delete).
+// Intended to be invoked periodically (e.g. pg_cron + pg_net); each invocation drains the
+// queue until it is empty or the time budget is used up.
+// Env secrets required:
+// - FEISHU_supabase-feishu-bridge_ENCRYPT_KEY: the Encrypt Key from Feishu console
+//
+// 【输出格式】
+// { "read": 120, "routed": 118, "failed": 2, "invalid": 0 }
+// failed 的消息不删除，可见性超时后重新投递；无法解密的消息（invalid）直接删除
+import { getEncryptKey } from '../_shared/getDenoEnv.ts';
+import { supabaseClient, deletePgmqMessages } from '../_shared/supabaseClient.ts';
+import { decryptFeishu } from '../_shared/feishuCrypto.ts';
+import { jsonResponse } from '../_shared/cors.ts';
+import { routeFeishuEvent, WEBHOOK_INBOX_QUEUE_NAME } from '../_shared/feishuEventRouter.ts';
+
+// 每次读取的消息数与可见性超时（秒）
+const READ_BATCH_SIZE = 100;
+const VISIBILITY_TIMEOUT_SECONDS = 120;
+// 单次调用的处理时间预算，留出余量避免触发 Edge Function 超时
+const TIME_BUDGET_MS = 60 * 1000;
+
+interface InboxMessage {
+  msg_id: number;
+  message: { encrypt?: string };
+}
+
+/**
+ * 处理一批收件箱消息
+ * @returns 本批统计与可删除的消息ID
+ */
+async function processBatch(messages: InboxMessage[], encryptKey: string) {
+  const ackIds: number[] = [];
+  let routed = 0;
+  let failed = 0;
+  let invalid = 0;
+
+  await Promise.all(messages.map(async (msg) => {
+    let event: any;
+    try {
+      event = await decryptFeishu(msg.message?.encrypt ?? '', encryptKey);
+    } catch (error) {
+      // 签名已在 webhook 校验过，解密失败说明数据损坏，重试无意义
+      console.error(`解密失败，丢弃消息 ${msg.msg_id}:`, error);
+      invalid++;
+      ackIds.push(msg.msg_id);
+      return;
+    }
+    if (await routeFeishuEvent(event)) {
+      routed++;
+      ackIds.push(msg.msg_id);
+    } else {
+      failed++;
+    }
+  }));
+
+  return { ackIds, routed, failed, invalid };
+}
+
+Deno.serve(async (_req) => {
+  try {
+    const encryptKey = getEncryptKey();
+    const startedAt = Date.now();
+    const summary = { read: 0, routed: 0, failed: 0, invalid: 0 };
+
+    while (Date.now() - startedAt < TIME_BUDGET_MS) {
+      const { data, error } = await supabaseClient.schema('pgmq_public').rpc('read', {
+        queue_name: WEBHOOK_INBOX_QUEUE_NAME,
+        sleep_seconds: VISIBILITY_TIMEOUT_SECONDS,
+        n: READ_BATCH_SIZE
+      });
+      if (error) {
+        throw new Error(`读取 ${WEBHOOK_INBOX_QUEUE_NAME} 失败: ${error.message}`);
+      }
+      const messages = (data ?? []) as InboxMessage[];
+      if (messages.length === 0) break;
+
+      console.log(`读取收件箱消息: ${messages.length} 条`);
+      summary.read += messages.length;
+      const { ackIds, routed, failed, invalid } = await processBatch(messages, encryptKey);
+      summary.routed += routed;
+      summary.failed += failed;
+      summary.invalid += invalid;
+
+      if (ackIds.length > 0) {
+        const results = await deletePgmqMessages(WEBHOOK_INBOX_QUEUE_NAME, ackIds);
+        const notDeleted = Object.entries(results).filter(([, r]) => r !== 'success');
+        if (notDeleted.length > 0) {
+          console.error('删除收件箱消息失败:', notDeleted);
+        }
+      }
+      if (messages.length < READ_BATCH_SIZE) break;
+    }
+
+    console.log('收件箱处理完成:', JSON.stringify(summary));
+    return jsonResponse(summary);
+  } catch (error) {
+    console.error('feishu-webhook-worker 错误:', error);
+    return jsonResponse({ error: error.message ?? 'Internal error' }, { status: 500 });
+  }
+});
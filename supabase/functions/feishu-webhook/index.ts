@@ -3,125 +3,18 @@
 // Env secrets required:
 // - FEISHU_supabase-feishu-bridge_ENCRYPT_KEY: the Encrypt Key from Feishu console
 // - FEISHU_supabase-feishu-bridge_VERIFICATION_KEY: if set, will be validated against decrypted token
-import { createHash } from "node:crypto";
-import { getEncryptKey } from '../_shared/getDenoEnv.ts';
-import { supabaseClient, deleteRecords } from '../_shared/supabaseClient.ts';
-import { decryptFeishu } from '../_shared/feishuCrypto.ts';
+// Optional env:
+// - FEISHU_WEBHOOK_BATCH_WINDOW_MS: micro-batch window for upsert messages (default 1000, 0 = send per event)
+// - FEISHU_WEBHOOK_BATCH_MAX_RECORDS: flush a batch early once it holds this many record_ids (default 500)
+// - FEISHU_WEBHOOK_ACK_FIRST: "true" to only verify the signature, append the raw encrypted body to the
+//   "webhook_inbox" queue and return; feishu-webhook-worker then decrypts and routes events in bulk
+import { getEncryptKey, getWebhookAckFirst } from '../_shared/getDenoEnv.ts';
+import { supabaseClient } from '../_shared/supabaseClient.ts';
+import { decryptFeishu, computeFeishuSignature } from '../_shared/feishuCrypto.ts';
 import { jsonResponse } from '../_shared/cors.ts';
-// 处理事件
-// 事件请求体请参考https://open.feishu.cn/document/docs/bitable-v1/events/bitable_record_changed#bea8b65
-async function doAction(eventBody) {
-  console.log("eventBody:", eventBody);
-  const grouped = eventBody.event.action_list.reduce((acc, item)=>{
-    // action 可能: "record_added", "record_deleted", "record_edited"
-    const key = item.action;
-    if (!acc[key]) acc[key] = [];
-    acc[key].push(item);
-    // 同时分组记录 record_id
-    if (key === "record_added" && item.record_id) {
-      acc.record_id_added.push(item.record_id);
-    } else if (key === "record_deleted" && item.record_id) {
-      acc.record_id_deleted.push(item.record_id);
-    } else if (key === "record_edited" && item.record_id) {
-      acc.record_id_edited.push(item.record_id);
-    }
-    return acc;
-  }, {
-    record_added: [],
-    record_deleted: [],
-    record_edited: [],
-    record_id_added: [],
-    record_id_deleted: [],
-    record_id_edited: []
-  });
-
-  // 处理 add 和 update 操作 - 发送到 upsertDBFromBitable 队列
-  const upsertRecordIds = Array.from(new Set([
-    ...grouped.record_id_added,
-    ...grouped.record_id_edited
-  ].filter(Boolean)));
-  
-  if (upsertRecordIds.length > 0) {
-    console.log("发送 upsert 消息到队列，记录数:", upsertRecordIds.length);
-    const upsertMessage = {
-      app_token: eventBody.event.file_token,
-      table_id: eventBody.event.table_id,
-      records: upsertRecordIds.map(record_id => ({ record_id }))
-    };
-    
-    try {
-      const upsertResult = await supabaseClient.schema('pgmq_public').rpc('send', {
-        message: {"function_name": "upsertDBFromBitable", ...upsertMessage},
-        queue_name: 'invoke_edge_function_jobs',
-        sleep_seconds: 0
-      });
-      console.log("upsert send 结果:", JSON.stringify(upsertResult, null, 2));
-      console.log("成功发送 upsert 消息到队列");
-    } catch (error) {
-      console.error("发送 upsert 消息失败:", error);
-    }
-  }
-
-  // 处理 delete 操作 - 直接异步调用deleteRecords批量删除
-  if (grouped.record_id_deleted.length > 0) {
-    console.log("开始异步删除记录，记录数:", grouped.record_id_deleted.length);
-    
-    // 异步非阻塞调用删除操作
-    (async () => {
-      try {
-        console.log(`[异步删除] 开始处理 ${grouped.record_id_deleted.length} 条删除记录`);
-        
-        // 查询映射配置获取数据库表信息
-        const { data: mappingData, error: mappingError } = await supabaseClient
-          .from('feishuBitable_Mapping')
-          .select('db_schema, db_table')
-          .eq('app_token', eventBody.event.file_token)
-          .eq('table_id', eventBody.event.table_id)
-          .single();
-
-        if (mappingError) {
-          console.error(`[异步删除] 查询映射配置失败:`, mappingError);
-          return;
-        }
-
-        if (!mappingData) {
-          console.error(`[异步删除] 未找到映射配置: app_token=${eventBody.event.file_token}, table_id=${eventBody.event.table_id}`);
-          return;
-        }
-
-        const { db_schema, db_table } = mappingData;
-        console.log(`[异步删除] 映射结果: db_schema=${db_schema}, db_table=${db_table}`);
-
-        // 构造删除数据
-        const deleteRows = grouped.record_id_deleted
-          .filter(Boolean)
-          .map(record_id => ({ record_id }));
-
-        if (deleteRows.length > 0) {
-          console.log(`[异步删除] 开始删除数据库记录: ${db_schema}.${db_table}`);
-          const deleteResult = await deleteRecords(
-            `${db_schema}.${db_table}`,
-            deleteRows,
-            'record_id'
-          );
-          console.log(`[异步删除] 数据库删除结果:`, deleteResult);
-          
-          if (deleteResult === 'success') {
-            console.log(`[异步删除] 成功删除 ${deleteRows.length} 条记录`);
-          } else {
-            console.error(`[异步删除] 删除失败:`, deleteResult);
-          }
-        } else {
-          console.log(`[异步删除] 没有有效的记录需要删除`);
-        }
-      } catch (error) {
-        console.error(`[异步删除] 处理过程中发生错误:`, error);
-      }
-    })();
-    
-    console.log("异步删除操作已启动，不阻塞主流程");
-  }
-}
+import { routeFeishuEvent, WEBHOOK_INBOX_QUEUE_NAME } from '../_shared/feishuEventRouter.ts';
+import { runInBackground } from '../_shared/concurrency.ts';
+// 事件处理（去重、upsert 微批、删除）见 _shared/feishuEventRouter.ts
 // --- 主流程 ---
 /**
  * 事件：https://open.feishu.cn/document/docs/bitable-v1/events/bitable_record_changed
@@ -210,27 +103,15 @@ Deno.serve(async (req)=>{
         });
       }
     }
+    // 4. 再做签名校验（签名规则完全符合你的要求）
+    // 注意：签名用的是"原始事件body",即原body字符串/Uint8Array
+    let signatureValid = false;
     try {
-      // 4. 再做签名校验（签名规则完全符合你的要求）
-      const enc = new TextEncoder();
-      const b1 = new Uint8Array([
-        ...enc.encode(String(timestamp ?? "")),
-        ...enc.encode(String(nonce ?? "")),
-        ...enc.encode(encryptKey)
-      ]);
-      // 注意：签名用的是"原始事件body",即原body字符串/Uint8Array
-      const b = new Uint8Array(b1.length + rawBodyUint8.length);
-      b.set(b1, 0);
-      b.set(rawBodyUint8, b1.length);
-      const s = createHash("sha256").update(b).digest("hex");
-      // 5. 校验成功才doAction
-      if (s === signature && decryptedEvent) {
-        void doAction(decryptedEvent); // 异步调用执行 doAction，不要 await！fire-and-forget
-      }
+      signatureValid = computeFeishuSignature(timestamp, nonce, encryptKey, rawBodyUint8) === signature;
     } catch (error) {
-      console.error("签名校验执行doAction异常:" + error.message);
+      console.error("签名校验异常:" + error.message);
     }
-    // 6. challenge响应
+    // 5. challenge响应
     if (decryptedEvent && decryptedEvent.challenge) {
       console.log("challenge:" + String(decryptedEvent.challenge));
       return jsonResponse({
@@ -244,10 +125,32 @@ Deno.serve(async (req)=>{
         challenge: String(payload.challenge)
       });
     }
+    // 6. 校验成功才处理事件
+    if (signatureValid && decryptedEvent) {
+      if (getWebhookAckFirst()) {
+        // ack-first：原始加密事件一次写入 webhook_inbox，失败时返回非 200 让飞书重试
+        const { error } = await supabaseClient.schema('pgmq_public').rpc('send', {
+          queue_name: WEBHOOK_INBOX_QUEUE_NAME,
+          message: { encrypt: payload.encrypt },
+          sleep_seconds: 0
+        });
+        if (error) {
+          console.error("写入 webhook_inbox 失败:", error);
+          return jsonResponse({
+            error: "enqueue failed"
+          }, {
+            status: 500
+          });
+        }
+      } else {
+        // 响应返回后继续处理，isolate 会等待处理完成再回收
+        runInBackground(routeFeishuEvent(decryptedEvent));
+      }
+    }
     // 接收到事件时，正常响应返回 HTTP 200，并携带 event_id，避免重复接收到事件
-    console.log("事件返回："+decryptedEvent.header.event_id);
+    console.log("事件返回："+decryptedEvent?.header?.event_id);
     return jsonResponse({
-      event_id: decryptedEvent.header.event_id
+      event_id: decryptedEvent?.header?.event_id
     });
   } catch (err) {
     console.error("function error: ", err);
@@ -20,7 +20,7 @@
 //    - 提高API调用效率，避免重复请求
 //
 // 3. 飞书API调用
-//    - 获取飞书访问令牌（tenant_access_token）
+//    - 获取飞书访问令牌（tenant_access_token，跨函数共享缓存，临近过期提前刷新）
 //    - 调用飞书字段列表API获取表格字段信息
 //    - 支持分页处理，获取所有字段数据
 //
@@ -85,43 +85,12 @@
 */
 
 
-import { supabaseClient, deletePgmqMessage } from '../_shared/supabaseClient.ts';
+import { supabaseClient, deletePgmqMessages } from '../_shared/supabaseClient.ts';
 import { jsonResponse } from '../_shared/cors.ts';
-import { getAppId, getAppSecret } from '../_shared/getDenoEnv.ts';
+import { bitableClient } from '../_shared/larkClient.ts';
 
 /**
- * 获取飞书访问令牌
- */
-async function getTenantAccessToken(): Promise<string | null> {
-  try {
-    const response = await fetch('https://open.feishu.cn/open-apis/auth/v3/tenant_access_token/internal', {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json'
-      },
-      body: JSON.stringify({
-        app_id: getAppId(),
-        app_secret: getAppSecret()
-      })
-    });
-    
-    const data = await response.json();
-    console.log('Token响应:', JSON.stringify(data, null, 2));
-    
-    if (data.code !== 0) {
-      console.error(`获取token失败: ${data.msg}`);
-      return null;
-    }
-    
-    return data.tenant_access_token;
-  } catch (error) {
-    console.error('获取访问令牌失败:', error);
-    return null;
-  }
-}
-
-/**
- * 调用飞书API获取表格字段列表（使用原生fetch）
+ * 调用飞书API获取表格字段列表（精简 fetch 客户端，自动翻页）
  * @param appToken 飞书应用token
  * @param tableId 飞书表格ID
  * @returns 字段列表或null（失败时）
@@ -134,69 +103,7 @@ async function getFeishuFields(appToken: string, tableId: string): Promise<any[]
       return null;
     }
     
-    // 1. 获取访问令牌
-    const tenantToken = await getTenantAccessToken();
-    if (!tenantToken) {
-      console.error('无法获取访问令牌');
-      return null;
-    }
-    
-    const allItems: any[] = [];
-    let pageToken: string | undefined = undefined;
-    const pageSize = 100;
-    
-    do {
-      try {
-        // 构建URL
-        let url = `https://open.feishu.cn/open-apis/bitable/v1/apps/${appToken}/tables/${tableId}/fields?page_size=${pageSize}`;
-        if (pageToken) {
-          url += `&page_token=${pageToken}`;
-        }
-        
-        // 使用原生fetch调用API
-        const response = await fetch(url, {
-          method: 'GET',
-          headers: {
-            'Authorization': `Bearer ${tenantToken}`,
-            'Content-Type': 'application/json'
-          }
-        });
-        
-        const data = await response.json();
-        console.log(`API响应:`, JSON.stringify(data, null, 2));
-        
-        if (data.code !== 0) {
-          console.error(`API调用失败: code=${data.code}, msg=${data.msg}`);
-          return null;
-        }
-        
-        if (data?.data?.items) {
-          const items = data.data.items;
-          console.log(`获取到 ${items.length} 个字段`);
-          allItems.push(...items);
-          
-          // 检查是否还有更多数据
-          pageToken = data.data.page_token;
-        } else {
-          console.warn(`API响应中没有items字段:`, data);
-          break;
-        }
-        
-        // 如果没有page_token或为空，说明已经获取完所有数据
-        if (!pageToken || pageToken === '') {
-          break;
-        }
-        
-      } catch (apiError: any) {
-        console.error(`分页API调用失败:`, {
-          error: apiError.message,
-          pageToken: pageToken,
-          stack: apiError.stack
-        });
-        
-        throw apiError;
-      }
-    } while (pageToken);
+    const allItems = await bitableClient.listFields(appToken, tableId);
 
     console.log(`成功获取所有字段列表，共${allItems.length}个字段`);
     
@@ -213,6 +120,7 @@ async function getFeishuFields(appToken: string, tableId: string): Promise<any[]
   } catch (error: any) {
     console.error(`调用飞书API异常:`, {
       error: error.message,
+      code: error.code,
       app_token: appToken,
       table_id: tableId,
       stack: error.stack
@@ -355,19 +263,18 @@ Deno.serve(async (req) => {
     
     await Promise.all(promises);
     
-    // 删除处理成功的队列消息
-    const deletePromises = validPayload.map(async (item) => {
-      if (item.message_id) {
-        const deleteResult = await deletePgmqMessage('invoke_edge_function_jobs', item.message_id);
+    // 删除处理成功的队列消息（一次批量删除）
+    const messageIds = validPayload.map(item => item.message_id).filter(Boolean);
+    if (messageIds.length > 0) {
+      const deleteResults = await deletePgmqMessages('invoke_edge_function_jobs', messageIds);
+      for (const [messageId, deleteResult] of Object.entries(deleteResults)) {
         if (deleteResult === 'success') {
-          console.log(`成功删除队列消息: message_id=${item.message_id}`);
+          console.log(`成功删除队列消息: message_id=${messageId}`);
         } else {
-          console.warn(`删除队列消息失败: message_id=${item.message_id}, error=${deleteResult}`);
+          console.warn(`删除队列消息失败: message_id=${messageId}, error=${deleteResult}`);
         }
       }
-    });
-    
-    await Promise.all(deletePromises);
+    }
     
     return jsonResponse({ 
       message: 'Success', 
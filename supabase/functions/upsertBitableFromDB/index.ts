@@ -17,14 +17,14 @@
 //    - UPDATE操作如果record_id为空，自动转为INSERT
 //
 // 3. 查询映射配置
-//    - 从 feishuBitable_Mapping 表查询字段映射
+//    - 从映射缓存（_shared/mappingCache.ts）获取字段映射，映射表变更时按版本号自动失效
 //    - 获取 app_token, table_id, 字段映射关系
 //    - 如果未找到映射，删除消息并跳过
 //
 // 4. 字段映射与转换
-//    - 根据映射配置转换字段
-//    - 过滤只读字段（type: 20,19,1001,1002,1003,1004,1005）
-//    - 使用 transformFieldValue 进行类型转换
+//    - 按 feishu_field_type 为每张表编译一次编码函数并缓存（见 _shared/mappingCompiler.ts）
+//    - 编译时过滤只读字段（type: 20,19,1001,1002,1003,1004,1005）
+//    - 数据库值直接编码为飞书写入格式（如日期 → 毫秒时间戳、关联 → record_id 数组）
 //
 // 5. 调用飞书API
 //    - INSERT: 调用 batchCreate API
@@ -34,12 +34,12 @@
 //
 // 6. 数据库回写（仅INSERT）
 //    - INSERT成功后，从飞书响应中提取 record_id
-//    - 更新数据库对应记录的 record_id 字段
+//    - 通过 sync_bulk_update 一次性更新数据库对应记录的 record_id 字段
 //    - 包括原本是UPDATE但record_id为空的记录
 //
 // 7. 消息队列清理
-//    - 无论成功或失败，都删除消息
-//    - 避免消息队列堆积和重复处理
+//    - 成功或永久失败（如参数错误、权限不足）时删除消息，避免无限重试
+//    - 限流 / 暂时性错误重试耗尽或熔断中时保留消息，等待可见性超时后重新投递
 //
 // 【输入格式】
 // {
@@ -72,9 +72,10 @@
 //
 // =============================================================================
 
-import { larkClient } from '../_shared/larkClient.ts';
-import { supabaseClient, deletePgmqMessage } from '../_shared/supabaseClient.ts';
-import { transformFieldValue } from '../_shared/transBitableRecordsToDB.ts';
+import { bitableClient } from '../_shared/larkClient.ts';
+import { deletePgmqMessages, bulkUpdateRecords } from '../_shared/supabaseClient.ts';
+import { getMappingByTable } from '../_shared/mappingCache.ts';
+import { isRetryableFeishuError } from '../_shared/feishuRetry.ts';
 
 declare const Deno: any;
 
@@ -165,8 +166,13 @@ Deno.serve(async (req) => {
             // 删除消息（精简日志，不打印逐批成功条数）
             await deleteMessages(chunk);
           } catch (error) {
+            if (isRetryableFeishuError(error)) {
+              // 限流 / 暂时性错误 / 熔断：保留消息，等待重新投递
+              console.warn(`⏸️ 暂时无法处理，保留消息 ${chunk.length} 条:`, (error as Error)?.message);
+              continue;
+            }
             console.error(`❌ 处理失败:`, error);
-            // 即使失败也删除消息，避免无限重试
+            // 永久失败也删除消息，避免无限重试
             await deleteMessages(chunk);
           }
         }
@@ -188,32 +194,15 @@ Deno.serve(async (req) => {
 });
 
 /**
- * 查询映射配置
+ * 查询映射配置（来自映射缓存，warm isolate 内不查询数据库）
  */
 async function getMapping(schema: string, table: string) {
-  const { data, error } = await supabaseClient
-    .schema('public')
-    .from('feishuBitable_Mapping')
-    .select('feishu_app_token, feishu_table_id, db_field, feishu_field_name, feishu_field_type')
-    .eq('db_schema', schema)
-    .eq('db_table', table);
-  
-  if (error) {
+  try {
+    return (await getMappingByTable(schema, table)) ?? null;
+  } catch (error) {
     console.error('查询映射失败:', error);
     return null;
   }
-  
-  if (!data?.length) return null;
-  
-  return {
-    app_token: data[0].feishu_app_token,
-    table_id: data[0].feishu_table_id,
-    field_mappings: data.map(r => ({
-      db_field: r.db_field,
-      feishu_field_name: r.feishu_field_name,
-      feishu_field_type: r.feishu_field_type
-    }))
-  };
 }
 
 /**
@@ -233,9 +222,9 @@ async function callFeishuAPI(type: string, mapping: any, messages: PgmqMessage[]
       user_id_type: 'open_id'
     };
   } else {
-    // 先把字段构造成 Map，同时确定每条消息的实际操作类型
-    const mapped = await Promise.all(messages.map(async m => {
-      const fieldsMap = await mapFields(m.NEW, mapping); // 返回 Map
+    // 先编码字段，同时确定每条消息的实际操作类型
+    const mapped = messages.map(m => {
+      const fields = mapFields(m.NEW, mapping);
       
       // 动态判断实际操作类型
       let actualType = type;
@@ -248,10 +237,10 @@ async function callFeishuAPI(type: string, mapping: any, messages: PgmqMessage[]
       return {
         actualType,
         record: actualType === 'UPDATE'
-          ? { record_id: m.NEW.record_id, fields: fieldsMap as Map<string, any> }
-          : { fields: fieldsMap as Map<string, any> }
+          ? { record_id: m.NEW.record_id, fields }
+          : { fields }
       };
-    }));
+    });
 
     // 按实际操作类型分组
     const insertRecords = mapped.filter(m => m.actualType === 'INSERT').map(m => m.record);
@@ -264,13 +253,7 @@ async function callFeishuAPI(type: string, mapping: any, messages: PgmqMessage[]
       const records = insertRecords.length >= updateRecords.length ? insertRecords : updateRecords;
       const actualType = insertRecords.length >= updateRecords.length ? 'INSERT' : 'UPDATE';
       
-      const normalized = records
-        .map(r => (
-          'record_id' in r
-            ? { record_id: (r as any).record_id, fields: Object.fromEntries((r as any).fields) }
-            : { fields: Object.fromEntries((r as any).fields) }
-        ))
-        .filter(r => 'fields' in r ? Object.keys((r as any).fields).length > 0 : true);
+      const normalized = records.filter(r => Object.keys(r.fields).length > 0);
 
       payload = {
         records: normalized,
@@ -284,13 +267,7 @@ async function callFeishuAPI(type: string, mapping: any, messages: PgmqMessage[]
       const records = insertRecords.length > 0 ? insertRecords : updateRecords;
       const actualType = insertRecords.length > 0 ? 'INSERT' : 'UPDATE';
       
-      const normalized = records
-        .map(r => (
-          'record_id' in r
-            ? { record_id: (r as any).record_id, fields: Object.fromEntries((r as any).fields) }
-            : { fields: Object.fromEntries((r as any).fields) }
-        ))
-        .filter(r => 'fields' in r ? Object.keys((r as any).fields).length > 0 : true);
+      const normalized = records.filter(r => Object.keys(r.fields).length > 0);
 
       payload = {
         records: normalized,
@@ -303,11 +280,11 @@ async function callFeishuAPI(type: string, mapping: any, messages: PgmqMessage[]
   }
 
   // 选择API方法（此时type已经是实际类型）
-  const apiMethod = {
+  const apiMethod = ({
     'INSERT': 'batchCreate',
     'UPDATE': 'batchUpdate',
     'DELETE': 'batchDelete'
-  }[type];
+  } as Record<string, 'batchCreate' | 'batchUpdate' | 'batchDelete'>)[type];
   
   // 调试：打印即将发送给飞书的payload（避免过大，仅显示前几项）
   try {
@@ -320,7 +297,7 @@ async function callFeishuAPI(type: string, mapping: any, messages: PgmqMessage[]
   }
 
   // 调用飞书API
-  const response = await larkClient.bitable.v1.appTableRecord[apiMethod]({
+  const response = await bitableClient[apiMethod]({
     path: { app_token: mapping.app_token, table_id: mapping.table_id },
     data: payload
   });
@@ -334,34 +311,20 @@ async function callFeishuAPI(type: string, mapping: any, messages: PgmqMessage[]
 }
 
 /**
- * 映射字段
+ * 映射字段（使用按映射编译好的编码函数，返回以飞书字段名为键的 fields）
  */
-async function mapFields(record: any, mapping: any) {
-  const fields = new Map<string, any>();
-  const readonly = [20, 19, 1001, 1002, 1003, 1004, 1005];
-  
-  for (const m of mapping.field_mappings) {
-    if (readonly.includes(m.feishu_field_type)) continue;
-    
-    if (record[m.db_field] !== undefined) {
-      try {
-        fields.set(m.feishu_field_name, transformFieldValue(record[m.db_field]));
-      } catch (error) {
-        console.warn(`字段转换失败: ${m.db_field}`, error);
-      }
-    }
-  }
-  
-  return fields;
+function mapFields(record: any, mapping: any): Record<string, any> {
+  return mapping.encode(record);
 }
 
 /**
- * 更新数据库record_id
+ * 更新数据库record_id（一次 sync_bulk_update 调用回写整批）
  */
 async function updateDatabase(response: any, schema: string, table: string) {
   const records = response.data?.records || [];
   console.log(`开始更新数据库record_id: ${records.length}条`);
   
+  const rows: Array<{ id: any; record_id: string }> = [];
   for (const record of records) {
     const id = record.fields?.id;
     const record_id = record.record_id;
@@ -370,40 +333,40 @@ async function updateDatabase(response: any, schema: string, table: string) {
       console.warn(`跳过无效记录: id=${id}, record_id=${record_id}`);
       continue;
     }
-    
-    try {
-      const { data, error } = await supabaseClient
-        .schema(schema)
-        .from(table)
-        .update({ record_id })
-        .eq('id', id)
-        .select();
-      
-      if (error) {
-        console.error(`❌ 更新失败: id=${id} -> record_id=${record_id}`, error);
-      } else {
-        const updatedRows = Array.isArray(data) ? data.length : 0;
-        if (updatedRows > 0) {
-          console.log(`✅ 更新成功: id=${id} -> record_id=${record_id} (影响行数: ${updatedRows})`);
-        } else {
-          console.warn(`⚠️ 未找到匹配记录: id=${id} -> record_id=${record_id}`);
-        }
-      }
-    } catch (error) {
-      console.error(`❌ 更新异常: id=${id} -> record_id=${record_id}`, error);
-    }
+    rows.push({ id, record_id });
+  }
+  
+  if (rows.length === 0) return;
+  
+  const { result, keys } = await bulkUpdateRecords(`${schema}.${table}`, rows, 'id');
+  if (result !== 'success') {
+    console.error(`❌ 批量更新record_id失败: ${result}`);
+    return;
+  }
+  
+  const updated = new Set(keys);
+  const missing = rows.filter(r => !updated.has(String(r.id)));
+  console.log(`✅ 更新成功: ${keys.length}条`);
+  if (missing.length > 0) {
+    console.warn(`⚠️ 未找到匹配记录:`, missing.map(r => `id=${r.id} -> record_id=${r.record_id}`));
   }
 }
 
 /**
- * 删除消息
+ * 删除消息（按队列分组，每个队列一次批量删除）
  */
 async function deleteMessages(messages: PgmqMessage[]) {
+  const idsByQueue = new Map<string, number[]>();
   for (const msg of messages) {
-    try {
-      await deletePgmqMessage(msg.queue_name, msg.message_id);
-    } catch (error) {
-      console.error(`删除消息失败: ${msg.message_id}`, error);
+    if (!idsByQueue.has(msg.queue_name)) idsByQueue.set(msg.queue_name, []);
+    idsByQueue.get(msg.queue_name)!.push(msg.message_id);
+  }
+  
+  for (const [queueName, msgIds] of idsByQueue) {
+    const results = await deletePgmqMessages(queueName, msgIds);
+    const failed = Object.entries(results).filter(([, r]) => r !== 'success');
+    if (failed.length > 0) {
+      console.error(`删除消息失败: queue=${queueName}`, failed);
     }
   }
 }
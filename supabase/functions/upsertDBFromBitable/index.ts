@@ -21,22 +21,25 @@
 //    - 提高API调用效率，减少重复请求
 //
 // 3. 飞书数据获取
-//    - 批量从飞书Bitable API获取完整记录数据
-//    - 按100条/批进行分页获取
-//    - 获取所有字段的详细数据
+//    - 不请求自动字段（创建/修改时间与人员）；行转换只读取映射中的飞书字段
+//    - 同一 isolate 内已缓存且不早于事件修改时间的记录直接复用，不再重复获取
+//    - 按100条/批流式获取，每获取到一页立即进入映射与写入
+//    - 写入第 k 页的同时继续获取后续页
 //
 // 4. 字段映射与转换
-//    - 查询feishuBitable_Mapping表获取映射配置
+//    - 映射配置来自 isolate 内的映射缓存（按版本号失效），warm isolate 不再查询 feishuBitable_Mapping
 //    - 将飞书字段名转换为数据库字段名
-//    - 使用transformFieldValue进行数据类型转换
+//    - 按 feishu_field_type 为每个 app_token + table_id 编译一次行转换函数并缓存，逐格直接按类型转换
+//    - 未配置字段类型的映射回退到 transformFieldValue
 //
 // 5. 数据库写入
-//    - 使用upsert操作写入Supabase数据库
-//    - 以record_id作为冲突解决键
+//    - 计算每行内容哈希（sync_hash 列），与库中哈希一致的行跳过写入
+//    - 前面的页先行写入；最后一页调用 sync_apply_and_ack，与本组队列消息删除在同一事务中完成
+//    - 以record_id作为冲突解决键（目标表record_id需有唯一约束）
 //    - 支持插入新记录或更新现有记录
 //
 // 6. 消息清理
-//    - 成功处理的消息从队列中删除
+//    - 写库成功的分组消息已在事务内删除；无数据可写的分组每个队列一次批量删除
 //    - 失败的消息保留在队列中等待重试
 //
 // 【输入格式】
@@ -60,9 +63,10 @@
 //   {
 //     "app_token": "bascnCMII2ORuAiS8katXFabcde",
 //     "table_id": "tblxxx123456789",
-//     "records": [{"record_id": "recxxx111"}]
+//     "records": [{"record_id": "recxxx111", "update_time": 1700000000}]
 //   }
 // ]
+// update_time（可选）：飞书事件中的修改时间（秒），用于判断缓存记录是否仍然有效
 //
 // 【输出格式】
 // 成功情况：
@@ -77,6 +81,7 @@
 //       "db_schema": "public",
 //       "db_table": "products",
 //       "processed_records": 5,
+//       "skipped_unchanged": 2,
 //       "upsert_result": "success"
 //     }
 //   ]
@@ -96,13 +101,14 @@
 //     }
 //   ]
 // }
-import { fetchBitableRecords } from '../_shared/larkClient.ts';
-import { upsertRecords, supabaseClient, deletePgmqMessage } from '../_shared/supabaseClient.ts';
-import { transformFieldValue } from '../_shared/transBitableRecordsToDB.ts';
+import { fetchBitableRecordsStream } from '../_shared/larkClient.ts';
+import { applyRowsAndAck, upsertRecords, filterUnchangedRows, deletePgmqMessages } from '../_shared/supabaseClient.ts';
+import { getMappingByBitable } from '../_shared/mappingCache.ts';
+import { groupByAppTokenAndTableId } from '../_shared/bitableGroups.ts';
 // —— 主流程函数 ——
 /**
  * upsertDBFromBitable
- * 接收 payload（单个或数组），按 app_token + table_id 分组 -> 先批量获取飞书记录 -> 查询映射 -> 字段重组 -> 转换 -> Supabase upsert
+ * 接收 payload（单个或数组），按 app_token + table_id 分组 -> 先批量获取飞书记录 -> 查询映射 -> 字段重组 -> 转换 -> Supabase upsert（与消息确认同一事务）
  * 注意：normalize 在函数开头内联处理；onConflict 固定为 "record_id"
  */ Deno.serve(async (req)=>{
   try {
@@ -136,7 +142,10 @@ import { transformFieldValue } from '../_shared/transBitableRecordsToDB.ts';
           console.warn('跳过无效记录:', record);
           continue;
         }
-        validRecords.push({
+        validRecords.push(record.update_time ? {
+          record_id: record.record_id,
+          update_time: record.update_time
+        } : {
           record_id: record.record_id
         });
       }
@@ -183,30 +192,63 @@ import { transformFieldValue } from '../_shared/transBitableRecordsToDB.ts';
       const group = groups[i];
       console.log(`\n=== 处理第${i + 1}组: app_token=${group.app_token}, table_id=${group.table_id} ===`);
       try {
-        // a) fetchBitableRecords
+        // a) fetchBitableRecordsStream：逐页获取，写入第 k 页时继续获取后续页
         const recordIds = group.records.map((r)=>r.record_id);
         console.log(`5.${i + 1}.a 准备获取飞书记录，record_ids:`, recordIds);
-        const feishuRecords = await fetchBitableRecords(group.app_token, group.table_id, recordIds);
-        console.log(`5.${i + 1}.a 获取到的飞书记录:`, JSON.stringify(feishuRecords, null, 2));
-        // b) remapBitableFields
-        console.log(`5.${i + 1}.b 开始字段映射和转换`);
-        const { db_schema, db_table, rows } = await remapBitableFields(group.app_token, group.table_id, feishuRecords);
-        console.log(`5.${i + 1}.b 映射结果: db_schema=${db_schema}, db_table=${db_table}`);
-        console.log(`5.${i + 1}.b 转换后的数据行:`, JSON.stringify(rows, null, 2));
-        // c) upsertRecords
-        if (rows.length > 0) {
+        // 事件 update_time 为秒级，取该秒结束时刻作为已知修改时间，命中缓存的记录不再重复获取
+        const modifiedSince = {};
+        for (const r of group.records){
+          if (r.update_time) modifiedSince[r.record_id] = (Number(r.update_time) + 1) * 1000;
+        }
+        // 先查询映射，映射不存在时不再请求飞书
+        const mapping = await getBitableMapping(group.app_token, group.table_id);
+        console.log(`5.${i + 1}.b 映射结果: db_schema=${mapping.db_schema}, db_table=${mapping.db_table}`);
+        let heldRows = null;
+        let pendingWrite = null;
+        let processed = 0;
+        let skipped = 0;
+        for await (const page of fetchBitableRecordsStream(group.app_token, group.table_id, recordIds, {
+          modifiedSince
+        })){
+          console.log(`5.${i + 1}.a 获取到飞书记录 ${page.length} 条`);
+          if (page.length === 0) continue;
+          // b) remapBitableFields
+          const rows = remapBitableFields(mapping, page);
+          processed += rows.length;
+          // c) 上一页先行写入（不确认消息）；最后一页留到循环结束后与消息一并提交
+          if (heldRows && heldRows.length > 0) {
+            const previous = pendingWrite ? await pendingWrite : null;
+            if (previous) {
+              if (previous.result !== 'success') throw new Error(previous.result);
+              skipped += previous.skipped;
+            }
+            pendingWrite = writeRows(mapping, heldRows, []);
+          }
+          heldRows = rows;
+        }
+        const previous = pendingWrite ? await pendingWrite : null;
+        if (previous) {
+          if (previous.result !== 'success') throw new Error(previous.result);
+          skipped += previous.skipped;
+        }
+        const { db_schema, db_table } = mapping;
+        // d) 最后一页：写库与删除本组队列消息在同一事务中完成
+        if (heldRows && heldRows.length > 0) {
           console.log(`5.${i + 1}.c 开始写入数据库: ${db_schema}.${db_table}`);
-          const upsertResult = await upsertRecords(`${db_schema}.${db_table}`, rows, 'record_id');
+          const { result: upsertResult, skipped: lastSkipped } = await writeRows(mapping, heldRows, group.msg_queue_info ?? []);
+          skipped += lastSkipped;
           console.log(`5.${i + 1}.c 数据库写入结果:`, JSON.stringify(upsertResult, null, 2));
-          // 设置处理结果状态
+          // 设置处理结果状态；成功时消息已在事务内删除
           group.process_result = upsertResult === 'success';
+          group.acked = group.process_result;
           results.push({
             group_index: i + 1,
             app_token: group.app_token,
             table_id: group.table_id,
             db_schema,
             db_table,
-            processed_records: rows.length,
+            processed_records: processed,
+            skipped_unchanged: skipped,
             upsert_result: upsertResult
           });
         } else {
@@ -219,7 +261,7 @@ import { transformFieldValue } from '../_shared/transBitableRecordsToDB.ts';
             table_id: group.table_id,
             db_schema,
             db_table,
-            processed_records: 0,
+            processed_records: processed,
             message: '没有数据需要写入'
           });
         }
@@ -238,23 +280,26 @@ import { transformFieldValue } from '../_shared/transBitableRecordsToDB.ts';
     }
     // 4) 汇总返回每组 upsert 统计
     console.log('6. 最终处理结果:', JSON.stringify(results, null, 2));
-    // 批量删除队列消息
+    // 批量删除队列消息（已在 applyRowsAndAck 中确认的分组跳过）
     console.log('7. 开始处理队列消息删除');
+    const idsByQueue = new Map();
     for (const group of groups){
+      if (group.acked === true) continue;
       if (group.process_result === true && group.msg_queue_info && group.msg_queue_info.length > 0) {
         for (const msgInfo of group.msg_queue_info){
-          try {
-            console.log(`7.删除队列消息: queue_name=${msgInfo.queue_name}, message_id=${msgInfo.message_id}`);
-            const pgmqResult = await deletePgmqMessage(msgInfo.queue_name, msgInfo.message_id);
-            console.log(`7.队列消息删除结果:`, pgmqResult);
-          } catch (pgmqError) {
-            console.error(`删除队列消息失败 (message_id=${msgInfo.message_id}):`, pgmqError);
-          }
+          if (!idsByQueue.has(msgInfo.queue_name)) idsByQueue.set(msgInfo.queue_name, []);
+          idsByQueue.get(msgInfo.queue_name).push(msgInfo.message_id);
         }
       } else if (group.process_result !== true) {
         console.log(`跳过删除队列消息: 数据库操作失败，保留相关的队列消息`);
       }
     }
+    // 每个队列一次批量删除
+    for (const [queue_name, message_ids] of idsByQueue){
+      console.log(`7.删除队列消息: queue_name=${queue_name}, message_ids=${message_ids.join(',')}`);
+      const pgmqResults = await deletePgmqMessages(queue_name, message_ids);
+      console.log(`7.队列消息删除结果:`, pgmqResults);
+    }
     console.log('=== upsertDBFromBitable 处理完成 ===\n');
     return new Response(JSON.stringify({
       success: true,
@@ -280,128 +325,75 @@ import { transformFieldValue } from '../_shared/transBitableRecordsToDB.ts';
 });
 // —— 工具函数 ——
 /**
- * 分组工具：将队列消息按 app_token + table_id 分组并合并 record_id 列表。
- * 作用：只要 app_token 或 table_id 不同就是新组；app_token 与 table_id 同时相同的合并为一组批处理
- */ function groupByAppTokenAndTableId(items) {
-  const groupMap = new Map();
-  for (const item of items){
-    const key = `${item.app_token}:${item.table_id}`;
-    if (groupMap.has(key)) {
-      const existingGroup = groupMap.get(key);
-      // 合并records数组，并在这里进行去重
-      const existingRecordIds = new Set(existingGroup.records.map((r)=>r.record_id));
-      for (const record of item.records){
-        if (!existingRecordIds.has(record.record_id)) {
-          existingGroup.records.push(record);
-          existingRecordIds.add(record.record_id);
-        }
-      }
-      // 合并msg_queue_info
-      if (item.msg_queue_info) {
-        if (!existingGroup.msg_queue_info) {
-          existingGroup.msg_queue_info = [];
-        }
-        existingGroup.msg_queue_info.push(...item.msg_queue_info);
-      }
-    } else {
-      // 创建新的分组，初始化process_result为false
-      const newGroup = {
-        ...item,
-        process_result: false,
-        // 对当前item的records进行去重
-        records: Array.from(new Set(item.records.map((r)=>r.record_id))).map((id)=>({
-            record_id: id
-          }))
-      };
-      groupMap.set(key, newGroup);
-    }
-  }
-  return Array.from(groupMap.values());
-}
-/**
- * 批量拉取飞书多维表格记录
- * 作用：调用 larkClient.bitable.v1.appTableRecord.batchGet，按 100 条/批获取记录详情
- * 注意：必须先拉取实际记录（以飞书返回为准），再查映射再重组
- */ /**
- * 合并查询映射与字段重组与值转换
- * 作用：根据 app_token + table_id 从 public."feishuBitable_Mapping" 查询 db_schema/db_table 与字段映射，并将 records 转换为可写入DB的行
- * 注意：只处理飞书记录中实际存在的字段，不存在的字段会被忽略（不添加到数据库记录中）
- * ⭐ 修改：自动忽略 id 字段，不将其包含在 upsert 数据中
- * 返回：{ db_schema, db_table, rows }
- */ async function remapBitableFields(app_token, table_id, records) {
+ * 查询映射配置
+ * 作用：根据 app_token + table_id 从映射缓存（_shared/mappingCache.ts）获取 db_schema/db_table 与字段映射，warm isolate 内不查询数据库
+ * 返回：{ db_schema, db_table, mappings, feishu_to_db, convert }（convert 为按 feishu_field_type 编译好的行转换函数）
+ */ async function getBitableMapping(app_token, table_id) {
   // 入口最小校验
-  if (!app_token || !table_id || !Array.isArray(records)) {
-    throw new Error('remapBitableFields: 参数不合法');
-  }
-  if (records.length === 0) {
-    // 无记录直接返回空
-    return {
-      db_schema: '',
-      db_table: '',
-      rows: []
-    };
-  }
-  // 查询映射
-  const { data, error } = await supabaseClient.schema('public').from('feishuBitable_Mapping').select('db_schema, db_table, feishu_field_name, db_field').eq('feishu_app_token', app_token).eq('feishu_table_id', table_id);
-  if (error) {
-    throw new Error(`查询映射失败: ${error.message}`);
+  if (!app_token || !table_id) {
+    throw new Error('getBitableMapping: 参数不合法');
   }
-  if (!data || data.length === 0) {
+  const mapping = await getMappingByBitable(app_token, table_id);
+  if (!mapping) {
     throw new Error(`未找到映射: app_token=${app_token}, table_id=${table_id}`);
   }
-  const first = data[0];
-  const db_schema = first.db_schema;
-  const db_table = first.db_table;
+  const { db_schema, db_table } = mapping;
   if (!db_schema || !db_table) {
     throw new Error('映射缺少 db_schema 或 db_table');
   }
-  // 使用查询出来的映射配置
-  const validMappings = data;
-  if (validMappings.length === 0) {
-    // 无有效字段映射时返回空 rows（避免写入无意义数据）
-    return {
-      db_schema,
-      db_table,
-      rows: []
-    };
+  return {
+    db_schema,
+    db_table,
+    mappings: mapping.fields,
+    feishu_to_db: mapping.feishu_to_db,
+    convert: mapping.convert
+  };
+}
+/**
+ * 字段重组与值转换
+ * 作用：使用按映射编译好的行转换函数（mapping.convert）将飞书 records 转换为可写入DB的行
+ * 注意：不存在的字段置为 null，id 字段不包含在 upsert 数据中
+ * 返回：rows
+ */ function remapBitableFields(mapping, records) {
+  if (!mapping || !Array.isArray(records)) {
+    throw new Error('remapBitableFields: 参数不合法');
   }
   const rows = [];
   for (const r of records){
     if (!r || !r.record_id) continue;
-    const srcFields = r.fields || {};
-    const outRow = {
-      record_id: r.record_id
-    };
-    // 根据 db_field 数组循环，构造数据库记录
-    for (const mapping of validMappings){
-      const dstKey = mapping.db_field;
-      const srcKey = mapping.feishu_field_name;
-      // ⭐ 关键修改：忽略 id 字段
-      if (dstKey === 'id') {
-        console.log(`跳过 id 字段映射: ${srcKey} -> ${dstKey}`);
-        continue;
-      }
-      if (srcKey && Object.prototype.hasOwnProperty.call(srcFields, srcKey)) {
-        // 如果飞书字段存在，需要转换值
-        try {
-          // 直接转换单个字段值
-          const fieldValue = srcFields[srcKey];
-          const converted = transformFieldValue(fieldValue);
-          outRow[dstKey] = converted ?? null;
-        } catch (error) {
-          console.warn(`转换字段 ${srcKey} 失败:`, error);
-          outRow[dstKey] = null;
-        }
-      } else {
-        // 如果飞书字段不存在，直接null
-        outRow[dstKey] = null;
-      }
+    rows.push(mapping.convert(r));
+  }
+  return rows;
+}
+/**
+ * 写入一页数据行
+ * 作用：按行内容哈希跳过未变化的行，再与给定的队列消息在同一事务中提交
+ *       messages 为空时（非最后一页）只写库，按请求体大小分块以 on_conflict upsert 写入
+ * 注意：不抛出异常，返回 { result, skipped }
+ */ async function writeRows(mapping, rows, messages) {
+  const table = `${mapping.db_schema}.${mapping.db_table}`;
+  try {
+    const { changed, skipped } = await filterUnchangedRows(table, rows, 'record_id');
+    if (messages.length === 0) {
+      const result = changed.length > 0 ? await upsertRecords(table, changed, 'record_id', {
+        mode: 'upsert'
+      }) : 'success';
+      return {
+        result,
+        skipped
+      };
     }
-    rows.push(outRow);
+    const { result } = await applyRowsAndAck(table, {
+      upserts: changed
+    }, 'record_id', messages);
+    return {
+      result,
+      skipped
+    };
+  } catch (error) {
+    return {
+      result: error.message,
+      skipped: 0
+    };
   }
-  return {
-    db_schema,
-    db_table,
-    rows
-  };
 }
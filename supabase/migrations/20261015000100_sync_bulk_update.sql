@@ -0,0 +1,79 @@
+-- 通用批量更新函数
+-- 以一条 UPDATE 语句按唯一键应用 JSONB 数组中的多行变更，返回实际更新的唯一键值
+-- 每行只更新自身携带的字段，未携带的字段保持原值（支持各行字段子集不同）
+--
+-- 调用示例：
+--   select * from public.sync_bulk_update('public', 'product', 'record_id',
+--     '[{"record_id": "rec1", "name": "A"}, {"record_id": "rec2", "price": 9.9}]');
+
+create or replace function public.sync_bulk_update(
+  p_schema text,
+  p_table text,
+  p_key text,
+  p_rows jsonb
+)
+returns setof text
+language plpgsql
+set search_path = ''
+as $$
+declare
+  v_columns text[];
+  v_assign text;
+  v_select text;
+  v_key_type text;
+begin
+  if p_rows is null or jsonb_typeof(p_rows) <> 'array' or jsonb_array_length(p_rows) = 0 then
+    return;
+  end if;
+
+  -- 只保留目标表中真实存在的可写列，唯一键本身不参与更新
+  select array_agg(distinct a.attname::text)
+    into v_columns
+  from jsonb_array_elements(p_rows) as r(value)
+  cross join lateral jsonb_object_keys(r.value) as k(name)
+  join pg_catalog.pg_attribute a
+    on a.attrelid = format('%I.%I', p_schema, p_table)::regclass
+   and a.attname = k.name
+   and a.attnum > 0
+   and not a.attisdropped
+   and a.attgenerated = ''
+  where k.name <> p_key;
+
+  if v_columns is null then
+    return;
+  end if;
+
+  -- 唯一键的列类型：把 JSON 中的键值转换为列类型后比较，才能使用唯一键上的索引
+  select pg_catalog.format_type(a.atttypid, a.atttypmod)
+    into v_key_type
+  from pg_catalog.pg_attribute a
+  where a.attrelid = format('%I.%I', p_schema, p_table)::regclass
+    and a.attname = p_key
+    and a.attnum > 0
+    and not a.attisdropped;
+
+  if v_key_type is null then
+    raise exception 'sync_bulk_update: key column % does not exist', p_key;
+  end if;
+
+  select string_agg(format('%I', c), ', '), string_agg(format('p.%I', c), ', ')
+    into v_assign, v_select
+  from unnest(v_columns) as c;
+
+  -- 以现有行合并本行变更后重建记录，从而只覆盖本行携带的字段
+  return query execute format(
+    'update %1$I.%2$I as t
+        set (%3$s) = (
+          select %4$s
+          from jsonb_populate_record(null::%1$I.%2$I, to_jsonb(t) || r.value) as p
+        )
+       from jsonb_array_elements($1) as r(value)
+      where t.%5$I = (r.value ->> %5$L)::%6$s
+      returning t.%5$I::text',
+    p_schema, p_table, v_assign, v_select, p_key, v_key_type
+  ) using p_rows;
+end;
+$$;
+
+revoke execute on function public.sync_bulk_update(text, text, text, jsonb) from public, anon, authenticated;
+grant execute on function public.sync_bulk_update(text, text, text, jsonb) to service_role;
@@ -0,0 +1,21 @@
+-- PGMQ 批量删除消息
+-- 与 pgmq_public.delete 相同的调用方式，但一次删除多个消息ID，返回实际删除的消息ID
+
+create or replace function pgmq_public.delete_batch(
+  queue_name text,
+  message_ids bigint[]
+)
+returns setof bigint
+language plpgsql
+set search_path = ''
+as $$
+begin
+  return query
+    select * from pgmq.delete(queue_name, message_ids);
+end;
+$$;
+
+comment on function pgmq_public.delete_batch(text, bigint[]) is 'Permanently deletes multiple messages from the specified queue. Returns the ids that were deleted.';
+
+revoke execute on function pgmq_public.delete_batch(text, bigint[]) from public, anon, authenticated;
+grant execute on function pgmq_public.delete_batch(text, bigint[]) to service_role;
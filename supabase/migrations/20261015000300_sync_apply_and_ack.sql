@@ -0,0 +1,106 @@
+-- 队列驱动同步的原子写入函数
+-- 在同一事务中：按唯一键 upsert 行、按唯一键删除行、删除来源 PGMQ 消息
+-- 任一步失败则整体回滚，消息保留在队列中等待重试，避免“已写库但未确认”导致的重复处理
+--
+-- 参数：
+--   p_upserts  - JSONB 数组，每个元素为一行（必须包含 p_key 字段）
+--   p_deletes  - 待删除行的唯一键值
+--   p_messages - JSONB 数组，元素格式为 {"queue_name": "...", "message_id": 123}
+-- 返回：{"upserted": n, "deleted": n, "acked": n}
+
+create or replace function public.sync_apply_and_ack(
+  p_schema text,
+  p_table text,
+  p_key text,
+  p_upserts jsonb default '[]'::jsonb,
+  p_deletes text[] default '{}',
+  p_messages jsonb default '[]'::jsonb
+)
+returns jsonb
+language plpgsql
+set search_path = ''
+as $$
+declare
+  v_columns text[];
+  v_insert_cols text;
+  v_update_set text;
+  v_key_type text;
+  v_upserted bigint := 0;
+  v_deleted bigint := 0;
+  v_acked bigint := 0;
+  v_count bigint;
+  v_queue record;
+begin
+  -- 1. upsert
+  if p_upserts is not null and jsonb_typeof(p_upserts) = 'array' and jsonb_array_length(p_upserts) > 0 then
+    select array_agg(distinct a.attname::text)
+      into v_columns
+    from jsonb_array_elements(p_upserts) as r(value)
+    cross join lateral jsonb_object_keys(r.value) as k(name)
+    join pg_catalog.pg_attribute a
+      on a.attrelid = format('%I.%I', p_schema, p_table)::regclass
+     and a.attname = k.name
+     and a.attnum > 0
+     and not a.attisdropped
+     and a.attgenerated = '';
+
+    if v_columns is null or not (p_key = any(v_columns)) then
+      raise exception 'sync_apply_and_ack: rows must contain key column %', p_key;
+    end if;
+
+    select string_agg(format('%I', c), ', ') into v_insert_cols
+    from unnest(v_columns) as c;
+
+    select string_agg(format('%I = excluded.%I', c, c), ', ') into v_update_set
+    from unnest(v_columns) as c
+    where c <> p_key;
+
+    execute format(
+      'insert into %1$I.%2$I (%3$s)
+       select %3$s from jsonb_populate_recordset(null::%1$I.%2$I, $1)
+       on conflict (%4$I) do %5$s',
+      p_schema, p_table, v_insert_cols, p_key,
+      coalesce('update set ' || v_update_set, 'nothing')
+    ) using p_upserts;
+    get diagnostics v_upserted = row_count;
+  end if;
+
+  -- 2. delete
+  if p_deletes is not null and cardinality(p_deletes) > 0 then
+    -- 把键值转换为唯一键的列类型后比较，才能使用唯一键上的索引
+    select pg_catalog.format_type(a.atttypid, a.atttypmod)
+      into v_key_type
+    from pg_catalog.pg_attribute a
+    where a.attrelid = format('%I.%I', p_schema, p_table)::regclass
+      and a.attname = p_key
+      and a.attnum > 0
+      and not a.attisdropped;
+
+    if v_key_type is null then
+      raise exception 'sync_apply_and_ack: key column % does not exist', p_key;
+    end if;
+
+    execute format('delete from %I.%I where %I = any($1::%s[])', p_schema, p_table, p_key, v_key_type)
+      using p_deletes;
+    get diagnostics v_deleted = row_count;
+  end if;
+
+  -- 3. 确认（删除）来源消息，每个队列一次
+  if p_messages is not null and jsonb_typeof(p_messages) = 'array' and jsonb_array_length(p_messages) > 0 then
+    for v_queue in
+      select m.value ->> 'queue_name' as queue_name,
+             array_agg((m.value ->> 'message_id')::bigint) as message_ids
+      from jsonb_array_elements(p_messages) as m(value)
+      group by 1
+    loop
+      select count(*) into v_count from pgmq.delete(v_queue.queue_name, v_queue.message_ids);
+      v_acked := v_acked + v_count;
+    end loop;
+  end if;
+
+  return jsonb_build_object('upserted', v_upserted, 'deleted', v_deleted, 'acked', v_acked);
+end;
+$$;
+
+revoke execute on function public.sync_apply_and_ack(text, text, text, jsonb, text[], jsonb) from public, anon, authenticated;
+grant execute on function public.sync_apply_and_ack(text, text, text, jsonb, text[], jsonb) to service_role;
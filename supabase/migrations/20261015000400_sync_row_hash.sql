@@ -0,0 +1,115 @@
+-- 飞书 → 数据库同步的行内容哈希
+-- 每张映射表增加 sync_hash 列，由同步路径写入本行映射字段的内容哈希
+-- 同步时哈希一致的行跳过写入，避免无变化的 UPDATE 触发下游触发器和队列消息
+--
+-- 非同步路径修改行时（未同时修改 sync_hash），触发器清空 sync_hash，
+-- 保证下一次同步一定会写入，不会因旧哈希误判为“无变化”
+
+create or replace function public.sync_hash_invalidate()
+returns trigger
+language plpgsql
+set search_path = ''
+as $$
+begin
+  if new.sync_hash is not distinct from old.sync_hash then
+    new.sync_hash := null;
+  end if;
+  return new;
+end;
+$$;
+
+-- 为指定表添加 sync_hash 列及失效触发器（幂等）
+-- 只处理普通表与分区表，视图等其他关系直接跳过；列与触发器都已存在时不执行 DDL，避免无谓的 AccessExclusiveLock
+create or replace function public.sync_ensure_hash_column(p_schema text, p_table text)
+returns void
+language plpgsql
+security definer
+set search_path = ''
+as $$
+declare
+  v_relid oid;
+  v_relkind "char";
+begin
+  select c.oid, c.relkind
+    into v_relid, v_relkind
+  from pg_catalog.pg_class c
+  join pg_catalog.pg_namespace n on n.oid = c.relnamespace
+  where n.nspname = p_schema
+    and c.relname = p_table;
+
+  if v_relid is null or v_relkind not in ('r', 'p') then
+    return;
+  end if;
+
+  if exists (
+       select 1 from pg_catalog.pg_attribute
+       where attrelid = v_relid and attname = 'sync_hash' and attnum > 0 and not attisdropped
+     )
+     and exists (
+       select 1 from pg_catalog.pg_trigger
+       where tgrelid = v_relid and tgname = 'sync_hash_invalidate'
+     ) then
+    return;
+  end if;
+
+  execute format('alter table %I.%I add column if not exists sync_hash text', p_schema, p_table);
+  execute format('drop trigger if exists sync_hash_invalidate on %I.%I', p_schema, p_table);
+  execute format(
+    'create trigger sync_hash_invalidate before update on %I.%I
+       for each row execute function public.sync_hash_invalidate()',
+    p_schema, p_table
+  );
+end;
+$$;
+
+revoke execute on function public.sync_ensure_hash_column(text, text) from public, anon, authenticated;
+
+-- 映射表新增或修改目标表时自动补齐 sync_hash 列
+-- 语句级触发：一次插入同一张表的多条字段映射只处理一次目标表
+create or replace function public.sync_ensure_hash_column_on_mapping()
+returns trigger
+language plpgsql
+security definer
+set search_path = ''
+as $$
+declare
+  v_target record;
+begin
+  for v_target in
+    select distinct db_schema, db_table
+    from new_rows
+    where db_schema is not null and db_table is not null
+  loop
+    perform public.sync_ensure_hash_column(v_target.db_schema, v_target.db_table);
+  end loop;
+  return null;
+end;
+$$;
+
+-- 带转换表的触发器不能指定 update of 列，插入与更新分为两个触发器
+drop trigger if exists sync_ensure_hash_column on public."feishuBitable_Mapping";
+drop trigger if exists sync_ensure_hash_column_insert on public."feishuBitable_Mapping";
+drop trigger if exists sync_ensure_hash_column_update on public."feishuBitable_Mapping";
+create trigger sync_ensure_hash_column_insert
+  after insert on public."feishuBitable_Mapping"
+  referencing new table as new_rows
+  for each statement execute function public.sync_ensure_hash_column_on_mapping();
+create trigger sync_ensure_hash_column_update
+  after update on public."feishuBitable_Mapping"
+  referencing new table as new_rows
+  for each statement execute function public.sync_ensure_hash_column_on_mapping();
+
+-- 为现有映射表补齐 sync_hash 列
+do $$
+declare
+  v_target record;
+begin
+  for v_target in
+    select distinct db_schema, db_table
+    from public."feishuBitable_Mapping"
+    where db_schema is not null and db_table is not null
+  loop
+    perform public.sync_ensure_hash_column(v_target.db_schema, v_target.db_table);
+  end loop;
+end;
+$$;
@@ -0,0 +1,16 @@
+-- 飞书 tenant_access_token 跨函数缓存
+-- 所有访问飞书的 Edge Function 共享同一个 token，冷启动时无需再请求飞书鉴权接口
+-- 仅 service_role 可访问（开启 RLS 且不建任何策略）
+
+create table if not exists public.feishu_tenant_tokens (
+  app_id text primary key,
+  tenant_access_token text not null,
+  expires_at timestamptz not null,
+  updated_at timestamptz not null default now()
+);
+
+comment on table public.feishu_tenant_tokens is '飞书 tenant_access_token 缓存，由 _shared/feishuToken.ts 维护';
+
+alter table public.feishu_tenant_tokens enable row level security;
+
+revoke all on table public.feishu_tenant_tokens from anon, authenticated;
@@ -0,0 +1,40 @@
+-- feishuBitable_Mapping 版本号
+-- 映射表每次变更（语句级触发器）都会递增 version，
+-- Edge Function 内的映射缓存（_shared/mappingCache.ts）只需查询这一行即可判断缓存是否仍然有效
+
+create table if not exists public.feishu_mapping_version (
+  id boolean primary key default true check (id),
+  version bigint not null default 0,
+  updated_at timestamptz not null default now()
+);
+
+comment on table public.feishu_mapping_version is 'feishuBitable_Mapping 的版本号（单行），由触发器维护';
+
+insert into public.feishu_mapping_version (id) values (true)
+on conflict (id) do nothing;
+
+alter table public.feishu_mapping_version enable row level security;
+
+revoke all on table public.feishu_mapping_version from anon, authenticated;
+
+create or replace function public.feishu_mapping_bump_version()
+returns trigger
+language plpgsql
+security definer
+set search_path = ''
+as $$
+begin
+  update public.feishu_mapping_version
+     set version = version + 1,
+         updated_at = now()
+   where id;
+  return null;
+end;
+$$;
+
+revoke execute on function public.feishu_mapping_bump_version() from public, anon, authenticated;
+
+drop trigger if exists feishu_mapping_bump_version on public."feishuBitable_Mapping";
+create trigger feishu_mapping_bump_version
+  after insert or update or delete or truncate on public."feishuBitable_Mapping"
+  for each statement execute function public.feishu_mapping_bump_version();
@@ -0,0 +1,66 @@
+-- 聚合的字段映射文档
+-- feishuBitable_Mapping 每个字段一行；本函数按 (app_token, table_id, db_schema, db_table) 聚合为一个 JSON 文档，
+-- 同一张飞书表映射到多张数据库表时每对各自一个文档，字段互不混合；
+-- 一次调用返回全部映射与当前版本号，供 _shared/mappingCache.ts 直接编译
+--
+-- 返回：
+-- {
+--   "version": 12,
+--   "tables": [{
+--     "app_token": "...", "table_id": "...", "db_schema": "public", "db_table": "product",
+--     "fields": [{ "db_field": "...", "feishu_field_name": "...", "feishu_field_type": 1, "readonly": false }],
+--     "feishu_to_db": { "飞书字段名": "db_field" },
+--     "db_to_feishu": { "db_field": "飞书字段名" }
+--   }]
+-- }
+
+create or replace function public.feishu_mapping_documents()
+returns jsonb
+language sql
+stable
+set search_path = ''
+as $$
+  select jsonb_build_object(
+    'version', (select v.version from public.feishu_mapping_version v where v.id),
+    'tables', coalesce(jsonb_agg(t.doc order by t.app_token, t.table_id, t.db_schema, t.db_table), '[]'::jsonb)
+  )
+  from (
+    select
+      m.feishu_app_token as app_token,
+      m.feishu_table_id as table_id,
+      m.db_schema,
+      m.db_table,
+      jsonb_build_object(
+        'app_token', m.feishu_app_token,
+        'table_id', m.feishu_table_id,
+        'db_schema', m.db_schema,
+        'db_table', m.db_table,
+        'fields', jsonb_agg(
+          jsonb_build_object(
+            'db_field', m.db_field,
+            'feishu_field_name', m.feishu_field_name,
+            'feishu_field_type', m.feishu_field_type,
+            -- 只读字段：查找引用、公式、创建时间、最后更新时间、创建人、修改人、自动编号
+            'readonly', coalesce(m.feishu_field_type::text in ('19', '20', '1001', '1002', '1003', '1004', '1005'), false)
+          )
+          order by m.db_field
+        ),
+        'feishu_to_db', coalesce(
+          jsonb_object_agg(m.feishu_field_name, m.db_field)
+            filter (where m.feishu_field_name is not null and m.db_field is not null),
+          '{}'::jsonb
+        ),
+        'db_to_feishu', coalesce(
+          jsonb_object_agg(m.db_field, m.feishu_field_name)
+            filter (where m.feishu_field_name is not null and m.db_field is not null),
+          '{}'::jsonb
+        )
+      ) as doc
+    from public."feishuBitable_Mapping" m
+    where m.feishu_app_token is not null and m.feishu_table_id is not null
+    group by m.feishu_app_token, m.feishu_table_id, m.db_schema, m.db_table
+  ) t;
+$$;
+
+revoke execute on function public.feishu_mapping_documents() from public, anon, authenticated;
+grant execute on function public.feishu_mapping_documents() to service_role;
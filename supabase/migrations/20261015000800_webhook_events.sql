@@ -0,0 +1,43 @@
+-- 飞书 webhook 事件去重
+-- feishu-webhook 处理事件前以 event_id 为唯一键插入一行，插入冲突即为飞书的重复投递，直接丢弃
+-- 飞书的重试间隔最长为数小时，记录保留 1 天后由 purge_webhook_events() 清理
+
+create table if not exists public.webhook_events (
+  event_id text primary key,
+  event_type text,
+  received_at timestamptz not null default now()
+);
+
+comment on table public.webhook_events is '已处理的飞书 webhook event_id，由 _shared/webhookEvents.ts 写入';
+
+create index if not exists webhook_events_received_at_idx on public.webhook_events (received_at);
+
+alter table public.webhook_events enable row level security;
+
+revoke all on table public.webhook_events from anon, authenticated;
+
+-- 清理超过保留期的事件记录，返回删除行数
+create or replace function public.purge_webhook_events(p_retention interval default interval '1 day')
+returns bigint
+language sql
+set search_path = ''
+as $$
+  with deleted as (
+    delete from public.webhook_events
+    where received_at < now() - p_retention
+    returning 1
+  )
+  select count(*) from deleted;
+$$;
+
+revoke execute on function public.purge_webhook_events(interval) from public, anon, authenticated;
+grant execute on function public.purge_webhook_events(interval) to service_role;
+
+-- 已启用 pg_cron 时每小时清理一次；未启用时可手动或由其他调度调用 purge_webhook_events()
+do $$
+begin
+  if exists (select 1 from pg_extension where extname = 'pg_cron') then
+    perform cron.schedule('purge-webhook-events', '17 * * * *', 'select public.purge_webhook_events()');
+  end if;
+end;
+$$;
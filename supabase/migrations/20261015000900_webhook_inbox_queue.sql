@@ -0,0 +1,11 @@
+-- ack-first webhook 收件箱队列
+-- FEISHU_WEBHOOK_ACK_FIRST 开启时，feishu-webhook 只校验签名并把原始加密事件写入 webhook_inbox，
+-- 由 feishu-webhook-worker 批量读取、解密并路由（可由 pg_cron + pg_net 定时调用该函数）
+
+do $$
+begin
+  if not exists (select 1 from pgmq.list_queues() where queue_name = 'webhook_inbox') then
+    perform pgmq.create('webhook_inbox');
+  end if;
+end;
+$$;